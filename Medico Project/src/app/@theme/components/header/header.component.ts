@@ -42,6 +42,8 @@ export class HeaderComponent implements OnInit, OnDestroy {
   };
 
   notifications: Notification[] = [];
+  notificationsNext: string | null = null;
+  loadingNotifications = false;
   unreadCount: number = 0;
   showNotifications: boolean = false;
 
@@ -92,8 +94,9 @@ export class HeaderComponent implements OnInit, OnDestroy {
       };
 
       // Load connection notifications
-      this.connectionService.getNotifications().subscribe((notifs) => {
-        this.notifications = notifs || [];
+      this.connectionService.getNotifications().subscribe((page) => {
+        this.notifications = page.results;
+        this.notificationsNext = page.next;
         this.updateUnreadCount();
       });
     }
@@ -231,6 +234,19 @@ export class HeaderComponent implements OnInit, OnDestroy {
     }
   }
 
+  // Older connection notifications, one page at a time.
+  loadMoreNotifications(event: Event) {
+    event.stopPropagation();
+    if (!this.notificationsNext || this.loadingNotifications) return;
+    this.loadingNotifications = true;
+    this.connectionService.getNotifications(this.notificationsNext).subscribe((page) => {
+      this.loadingNotifications = false;
+      this.notifications = [...this.notifications, ...page.results];
+      this.notificationsNext = page.next;
+      this.updateUnreadCount();
+    });
+  }
+
   updateUnreadCount() {
     this.unreadCount = this.notifications.filter((n) => !n.seen).length;
   }
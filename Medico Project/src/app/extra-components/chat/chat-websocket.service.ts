@@ -23,6 +23,9 @@ export class ChatWebsocketService {
   private messagesSubjects: { [threadId: number]: BehaviorSubject<WSMessage[]> } = {};
   private queue: { [threadId: number]: WSMessage[] } = {};
   private isConnected: { [threadId: number]: boolean } = {};
+  private heartbeats: { [threadId: number]: any } = {};
+  private onlineSubjects: { [threadId: number]: BehaviorSubject<number[]> } = {};
+  private typingSubjects: { [threadId: number]: BehaviorSubject<{ [userId: number]: string }> } = {};
 
   constructor(private authService: AuthService) {}
 
@@ -49,42 +52,22 @@ export class ChatWebsocketService {
       // Send queued messages
       this.queue[threadId].forEach(msg => this.sendMessage(msg));
       this.queue[threadId] = [];
+      // Keeps our presence alive on the server (entries expire without it)
+      clearInterval(this.heartbeats[threadId]);
+      this.heartbeats[threadId] = setInterval(() => this.sendFrame(threadId, { type: 'heartbeat' }), 30000);
     };
 
     ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        const tid = data.thread?.id || data.thread_id || threadId;
-
-        if (!this.messagesMap[tid]) this.messagesMap[tid] = [];
-        if (!this.messagesSubjects[tid]) this.messagesSubjects[tid] = new BehaviorSubject<WSMessage[]>([]);
-
-        const msg: WSMessage = {
-          id: data.id,
-          message: data.message || data.text || '',
-          sender_id: data.sender?.id || data.sender_id,
-          sender_username: data.sender?.username || data.sender_username,
-          created_at: data.created_at || new Date().toISOString(),
-          read_by: (data.read_by || []).map((u: any) => u.id),
-          tempId: data.tempId,
-          thread_id: tid
-        };
-
-        const threadMessages = this.messagesMap[tid];
-
-        // Replace temp message if exists
-        if (msg.tempId) {
-          const index = threadMessages.findIndex(m => m.tempId === msg.tempId);
-          if (index !== -1) threadMessages[index] = msg;
-          else threadMessages.push(msg);
-        } else {
-          // Avoid duplicates
-          if (!threadMessages.find(m => m.id === msg.id)) {
-            threadMessages.push(msg);
-          }
+        const frame = JSON.parse(event.data);
+        if (frame.type === 'presence' || frame.type === 'typing') {
+          this.handleIndicator(frame, threadId);
+          return;
         }
-
-        this.messagesSubjects[tid].next([...threadMessages]);
+        if (frame.type && frame.type !== 'history') return;
+        // Unread messages replayed on connect arrive batched in "history" frames
+        const frames = frame.type === 'history' ? frame.messages : [frame];
+        frames.forEach((data: any) => this.handleMessage(data, threadId));
       } catch (err) {
         console.error('❌ Invalid WebSocket message:', event.data, err);
       }
@@ -92,6 +75,7 @@ export class ChatWebsocketService {
 
     ws.onclose = () => {
       this.isConnected[threadId] = false;
+      clearInterval(this.heartbeats[threadId]);
       console.warn(`⚠️ WebSocket closed for thread ${threadId}, reconnecting in 3s...`);
       setTimeout(() => this.connect(threadId), 3000);
     };
@@ -102,6 +86,56 @@ export class ChatWebsocketService {
     };
   }
 
+  private handleIndicator(frame: any, threadId: number) {
+    const online = this.getOnlineSubject(threadId);
+    const typing = this.getTypingSubject(threadId);
+    if (frame.type === 'presence' && Array.isArray(frame.online)) {
+      online.next(frame.online);
+    } else if (frame.type === 'presence') {
+      const others = online.value.filter(id => id !== frame.user_id);
+      online.next(frame.online ? [...others, frame.user_id] : others);
+    } else {
+      const current = { ...typing.value };
+      if (frame.typing) current[frame.user_id] = frame.username;
+      else delete current[frame.user_id];
+      typing.next(current);
+    }
+  }
+
+  private handleMessage(data: any, threadId: number) {
+    const tid = data.thread?.id || data.thread_id || threadId;
+
+    if (!this.messagesMap[tid]) this.messagesMap[tid] = [];
+    if (!this.messagesSubjects[tid]) this.messagesSubjects[tid] = new BehaviorSubject<WSMessage[]>([]);
+
+    const msg: WSMessage = {
+      id: data.id,
+      message: data.message || data.text || '',
+      sender_id: data.sender?.id || data.sender_id,
+      sender_username: data.sender?.username || data.sender_username,
+      created_at: data.created_at || new Date().toISOString(),
+      read_by: (data.read_by || []).map((u: any) => u.id),
+      tempId: data.tempId,
+      thread_id: tid
+    };
+
+    const threadMessages = this.messagesMap[tid];
+
+    // Replace temp message if exists
+    if (msg.tempId) {
+      const index = threadMessages.findIndex(m => m.tempId === msg.tempId);
+      if (index !== -1) threadMessages[index] = msg;
+      else threadMessages.push(msg);
+    } else {
+      // Avoid duplicates
+      if (!threadMessages.find(m => m.id === msg.id)) {
+        threadMessages.push(msg);
+      }
+    }
+
+    this.messagesSubjects[tid].next([...threadMessages]);
+  }
+
   sendMessage(payload: WSMessage) {
     const threadId = payload.thread_id!;
     if (!this.isConnected[threadId] || !this.sockets[threadId]) {
@@ -111,8 +145,37 @@ export class ChatWebsocketService {
     this.sockets[threadId].send(JSON.stringify(payload));
   }
 
+  sendTyping(threadId: number, typing: boolean) {
+    this.sendFrame(threadId, { type: 'typing', typing });
+  }
+
+  private sendFrame(threadId: number, frame: any) {
+    if (this.isConnected[threadId] && this.sockets[threadId]) {
+      this.sockets[threadId].send(JSON.stringify(frame));
+    }
+  }
+
+  getOnline$(threadId: number) {
+    return this.getOnlineSubject(threadId).asObservable();
+  }
+
+  getTyping$(threadId: number) {
+    return this.getTypingSubject(threadId).asObservable();
+  }
+
+  private getOnlineSubject(threadId: number) {
+    if (!this.onlineSubjects[threadId]) this.onlineSubjects[threadId] = new BehaviorSubject<number[]>([]);
+    return this.onlineSubjects[threadId];
+  }
+
+  private getTypingSubject(threadId: number) {
+    if (!this.typingSubjects[threadId]) this.typingSubjects[threadId] = new BehaviorSubject<{ [userId: number]: string }>({});
+    return this.typingSubjects[threadId];
+  }
+
   disconnect(threadId: number) {
     if (this.sockets[threadId]) {
+      clearInterval(this.heartbeats[threadId]);
       this.sockets[threadId].close();
       this.isConnected[threadId] = false;
       delete this.sockets[threadId];
@@ -2,12 +2,12 @@ import { Component, OnDestroy, OnInit,ElementRef } from '@angular/core';
 import { NbThemeService, NbDialogService } from '@nebular/theme';
 import { Router } from '@angular/router';
 import { AppointmentService } from '../../services/appointment.service';
-import { takeWhile, debounceTime } from 'rxjs/operators';
+import { takeWhile, debounceTime, distinctUntilChanged } from 'rxjs/operators';
 import { Subject } from 'rxjs';
 import { VideoCallComponent } from './video-call/video-call.component';
 import { ChatWebsocketService } from '../../extra-components/chat/chat-websocket.service';
 import { ChatService } from '../extra-components/chat/chat.service';
-import { ConnectionService, Connection, CommunityUser } from '../../services/connection.service';
+import { ConnectionService, Connection, CommunityUser, Page } from '../../services/connection.service';
 import { Message } from '../extra-components/chat/chat.service';  // <- make sure this is imported
 
 interface OpenChat {
@@ -33,6 +33,9 @@ export class DashboardComponent implements OnInit, OnDestroy {
 
   communityUsers: CommunityUser[] = [];
   filteredCommunityUsers: CommunityUser[] = [];
+  communitySearch = '';
+  communityNext: string | null = null;
+  loadingCommunity = false;
 
 openChats: { user: CommunityUser; threadId: number; messages: Message[] }[] = [];
 
@@ -65,7 +68,7 @@ openChats: { user: CommunityUser; threadId: number; messages: Message[] }[] = []
     this.loadCommunityUsers();
 
     this.searchSubject
-      .pipe(debounceTime(300), takeWhile(() => this.alive))
+      .pipe(debounceTime(300), distinctUntilChanged(), takeWhile(() => this.alive))
       .subscribe(query => this.filterCommunity(query));
   }
 
@@ -83,19 +86,35 @@ openChats: { user: CommunityUser; threadId: number; messages: Message[] }[] = []
     );
   }
 
-  private loadCommunityUsers() {
-    this.connectionService.getCommunityUsers().subscribe(
-      (res: CommunityUser[]) => {
+  // Searching happens server-side; `more` appends the next page of the current search.
+  private loadCommunityUsers(more = false) {
+    if (more && !this.communityNext) return;
+    const search = this.communitySearch;
+    this.loadingCommunity = true;
+
+    this.connectionService.getCommunityUsers(search, more ? this.communityNext : null).subscribe(
+      (page: Page<CommunityUser>) => {
+        if (search !== this.communitySearch) return; // a newer search is on its way
+        this.loadingCommunity = false;
         if (!this.currentUserId) return;
 
-        this.communityUsers = res.filter(u => u.id !== this.currentUserId);
+        const users = page.results.filter(u => u.id !== this.currentUserId);
+        this.communityUsers = more ? [...this.communityUsers, ...users] : users;
         this.filteredCommunityUsers = [...this.communityUsers];
+        this.communityNext = page.next;
         this.updateCommunityUserStatuses();
       },
-      err => console.error('Failed to load community users', err)
+      err => {
+        this.loadingCommunity = false;
+        console.error('Failed to load community users', err);
+      }
     );
   }
 
+  loadMoreCommunityUsers() {
+    if (!this.loadingCommunity) this.loadCommunityUsers(true);
+  }
+
   private updateCommunityUserStatuses() {
     if (!this.currentUserId) return;
     const newStatus: { [userId: number]: 'none' | 'pending' | 'connected' } = {};
@@ -168,11 +187,9 @@ openChats: { user: CommunityUser; threadId: number; messages: Message[] }[] = []
   onSearch(query: string) { this.searchSubject.next(query); }
 
   private filterCommunity(query: string) {
-    const lower = query.toLowerCase();
-    this.filteredCommunityUsers = this.communityUsers.filter(
-      u => u.username.toLowerCase().includes(lower) ||
-           (u.first_name && u.first_name.toLowerCase().includes(lower))
-    );
+    this.communitySearch = query.trim();
+    this.communityNext = null;
+    this.loadCommunityUsers();
   }
 
   // ----------------------------- Helpers -----------------------------
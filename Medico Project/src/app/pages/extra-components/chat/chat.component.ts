@@ -7,6 +7,9 @@ import { ChatWebsocketService, WSMessage } from '../../../extra-components/chat/
 import { ChatService, Message, ThreadDetail } from './chat.service';
 import { AuthService } from '../../../@core/services/auth.service';
 
+// threads-with-messages/<id>/ returns at most this many of the newest messages.
+const HISTORY_PAGE_SIZE = 50;
+
 @Component({
   selector: 'ngx-chat',
   templateUrl: './chat.component.html',
@@ -22,9 +25,13 @@ export class ChatComponent implements AfterViewChecked, OnInit, OnDestroy {
   messageText: string = '';
   currentUserId?: number;
 
+  hasOlder: boolean = false;
+  loadingOlder: boolean = false;
+
   private wsSub?: Subscription;
   private wsConnected: boolean = false;
-  @ViewChild('chatBody') private chatBody!: ElementRef;
+  private restoreScroll?: { height: number; top: number };
+  @ViewChild('chatBody', { read: ElementRef }) private chatBody!: ElementRef;
 
   constructor(
     private chatService: ChatService,
@@ -51,7 +58,16 @@ export class ChatComponent implements AfterViewChecked, OnInit, OnDestroy {
   }
 
   ngAfterViewChecked() {
-    this.scrollToBottom();
+    // Keep the same message in view after older history was prepended.
+    if (!this.restoreScroll) return;
+    const el = this.chatBody?.nativeElement;
+    if (el) {
+      // Jump, don't animate: the body scrolls smoothly by default.
+      el.style.scrollBehavior = 'auto';
+      el.scrollTop = el.scrollHeight - this.restoreScroll.height + this.restoreScroll.top;
+      el.style.scrollBehavior = '';
+    }
+    this.restoreScroll = undefined;
   }
 
   ngOnDestroy() {
@@ -69,13 +85,8 @@ export class ChatComponent implements AfterViewChecked, OnInit, OnDestroy {
     this.chatService.getThreadWithMessages(threadId).subscribe({
       next: (thread) => {
         console.log('🟢 [ChatService] Loaded thread:', thread);
-        // normalize sender to always be an object { id, username }
-        this.messages = (thread.messages || []).map(m => ({
-          ...m,
-          sender: typeof m.sender === 'object'
-            ? m.sender
-            : { id: m.sender, username: (m as any).sender_username || '' },
-        }));
+        this.messages = (thread.messages || []).map(m => this.normalize(m));
+        this.hasOlder = this.messages.length >= HISTORY_PAGE_SIZE;
         this.thread = thread;
 
         console.log('🟢 [ChatService] Normalized messages:', this.messages);
@@ -89,6 +100,43 @@ export class ChatComponent implements AfterViewChecked, OnInit, OnDestroy {
     });
   }
 
+  /** Normalize sender to always be an object { id, username } */
+  private normalize(m: any): Message {
+    return {
+      ...m,
+      sender: m.sender && typeof m.sender === 'object'
+        ? m.sender
+        : { id: m.sender_id ?? m.sender, username: m.sender_username || '' },
+    };
+  }
+
+  /** Load the previous page of history when scrolled near the top */
+  onScroll() {
+    const el = this.chatBody?.nativeElement;
+    if (el && el.scrollTop < 40) this.loadOlder();
+  }
+
+  loadOlder() {
+    if (!this.hasOlder || this.loadingOlder || !this.threadId || !this.messages.length) return;
+    const el = this.chatBody.nativeElement;
+    this.loadingOlder = true;
+
+    this.chatService.getOlderMessages(this.threadId, this.messages[0].id, HISTORY_PAGE_SIZE).subscribe({
+      next: (page) => {
+        const known = new Set(this.messages.map(m => m.id));
+        const older = page.results.map(m => this.normalize(m)).filter(m => !known.has(m.id));
+        this.restoreScroll = { height: el.scrollHeight, top: el.scrollTop };
+        this.messages = [...older, ...this.messages];
+        this.hasOlder = !!page.previous;
+        this.loadingOlder = false;
+      },
+      error: (err) => {
+        this.loadingOlder = false;
+        console.error(err);
+      },
+    });
+  }
+
   /** Connect WebSocket for real-time updates */
   private connectWebSocket(threadId: number) {
     // Cleanup old WS subscription before connecting
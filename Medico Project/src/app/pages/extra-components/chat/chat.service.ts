@@ -26,6 +26,13 @@ export interface ThreadDetail {
   messages: Message[];
 }
 
+// One page of /threads/<id>/messages/; `previous` is null once the oldest message is reached.
+export interface MessagePage {
+  next: string | null;
+  previous: string | null;
+  results: Message[];
+}
+
 @Injectable({ providedIn: 'root' })
 export class ChatService {
   private apiUrl = 'http://localhost:8000/api'; // adjust if your API URL differs
@@ -57,6 +64,13 @@ getOrCreateThreadWithUser(userId: number): Observable<ThreadDetail> {
 }
 
 
+  // Older history: the page of messages right before `beforeId`, oldest first.
+  getOlderMessages(threadId: number, beforeId: number, pageSize: number = 50): Observable<MessagePage> {
+    return this.http.get<MessagePage>(`${this.apiUrl}/threads/${threadId}/messages/`, {
+      params: { before: beforeId.toString(), page_size: pageSize.toString() },
+    });
+  }
+
   // Send message via REST (for initial storage, WebSocket handles real-time)
   sendMessage(threadId: number, text: string): Observable<Message> {
     return this.http.post<Message>(`${this.apiUrl}/messages/`, {
@@ -38,6 +38,12 @@ export interface CommunityUser {
   link_status: 'none' | 'pending' | 'connected';
 }
 
+// One page of a cursor-paginated list; `next` is the URL of the following page.
+export interface Page<T> {
+  results: T[];
+  next: string | null;
+}
+
 @Injectable({
   providedIn: 'root',
 })
@@ -179,22 +185,29 @@ getCurrentUserRole(): 'patient' | 'doctor' | 'kine' | 'prothesist' | null {
 
 
   // -----------------------------
-  // Get all community users
+  // Community users, one page at a time
   // -----------------------------
-  getCommunityUsers(): Observable<CommunityUser[]> {
+  getCommunityUsers(search: string = '', pageUrl: string | null = null): Observable<Page<CommunityUser>> {
     const userId = this.getCurrentUserId();
-    if (!userId) return of([]);
+    if (!userId) return of({ results: [], next: null });
+
+    // `next` links already carry the search term and the cursor.
+    const url = pageUrl || `${this.baseUrl}community/`;
+    const params: { [param: string]: string } = !pageUrl && search ? { search } : {};
 
-    return this.http.get<CommunityUser[]>(`${this.baseUrl}community/`, this.getAuthHeaders()).pipe(
-      map(users =>
-        users
+    return this.http.get<{ next: string | null; previous: string | null; results: CommunityUser[] }>(
+      url, { ...this.getAuthHeaders(), params }
+    ).pipe(
+      map(page => ({
+        next: page.next,
+        results: page.results
           .filter(u => u.id !== userId)
           .map(u => this.withProfileUrls(u))
-          .map(u => ({ ...u, link_status: u.link_status || 'none' }))
-      ),
+          .map(u => ({ ...u, link_status: u.link_status || 'none' })),
+      })),
       catchError(err => {
         console.error('Failed to fetch community users', err);
-        return of([]);
+        return of({ results: [], next: null });
       })
     );
   }
@@ -220,16 +233,17 @@ getCurrentUserRole(): 'patient' | 'doctor' | 'kine' | 'prothesist' | null {
   // -----------------------------
 // Notifications
 // -----------------------------
-getNotifications(): Observable<Connection[]> {
+getNotifications(pageUrl: string | null = null): Observable<Page<Connection>> {
   return this.http
-    .get<Connection[]>(`${this.baseUrl}notifications/`, this.getAuthHeaders())
+    .get<{ next: string | null; previous: string | null; results: Connection[] }>(
+      pageUrl || `${this.baseUrl}notifications/`, this.getAuthHeaders()
+    )
     .pipe(
-      map(notifs => notifs.map(n => this.withProfileUrls(n))),
+      map(page => ({ next: page.next, results: page.results.map(n => this.withProfileUrls(n)) })),
       catchError(err => {
         console.error('Failed to fetch notifications', err);
-        return of([]);
+        return of({ results: [], next: null });
       })
     );
 }
 }
-
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db import transaction
+
 from .models import User, Appointment
 
 # -----------------------------
@@ -22,14 +24,23 @@ class AppointmentAdmin(admin.ModelAdmin):
     search_fields = ('patient__username', 'doctor__username')
     actions = ['approve_appointments', 'reject_appointments']
 
+    # Saved one by one (not queryset.update) so the dashboard rollup and cache signals fire.
+    def _set_status(self, queryset, status):
+        with transaction.atomic():
+            appointments = list(queryset.select_for_update())
+            for appointment in appointments:
+                appointment.status = status
+                appointment.save(update_fields=['status'])
+        return len(appointments)
+
     # Custom action to approve selected appointments
     def approve_appointments(self, request, queryset):
-        updated = queryset.update(status='approved')
+        updated = self._set_status(queryset, 'approved')
         self.message_user(request, f"{updated} appointment(s) approved.")
     approve_appointments.short_description = "Approve selected appointments"
 
     # Custom action to reject selected appointments
     def reject_appointments(self, request, queryset):
-        updated = queryset.update(status='rejected')
+        updated = self._set_status(queryset, 'rejected')
         self.message_user(request, f"{updated} appointment(s) rejected.")
     reject_appointments.short_description = "Reject selected appointments"
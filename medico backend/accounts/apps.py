@@ -5,5 +5,6 @@ class AccountsConfig(AppConfig):
     name = 'accounts'
 
     def ready(self):
-        # Import signals so they get registered
+        # Import signals and checks so they get registered
         import accounts.signals
+        import accounts.checks
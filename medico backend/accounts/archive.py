@@ -0,0 +1,107 @@
+"""
+Hot/cold split of chat messages.
+
+The `archive_messages` command moves messages older than MESSAGE_RETENTION_DAYS
+from the message table into ArchivedMessage, with the text zlib-compressed. The
+hot table and its indexes then only hold recent traffic, which is all that
+unread counts, replays, search and last-message lookups read. History reads go
+through history_page(), which carries on into the archive once the hot rows run
+out; ids and timestamps are kept, so cursors stay valid across the boundary.
+
+Archived messages are not searchable and no longer count as unread.
+"""
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedMessage, Message
+from . import changes
+
+
+def horizon(days=None):
+    if days is None:
+        days = getattr(settings, 'MESSAGE_RETENTION_DAYS', 365)
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_before(cutoff, batch_size=None):
+    """
+    Moves every message created before `cutoff` into the archive, one transaction per batch.
+    Returns the number of messages moved.
+    """
+    batch_size = batch_size or getattr(settings, 'MESSAGE_ARCHIVE_BATCH_SIZE', 1000)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Message.objects.filter(created_at__lt=cutoff).order_by('id')
+                .values_list('id', 'thread_id', 'sender_id', 'text', 'created_at')[:batch_size]
+            )
+            if not rows:
+                return moved
+            ArchivedMessage.objects.bulk_create([
+                ArchivedMessage(
+                    id=message_id,
+                    thread_id=thread_id,
+                    sender_id=sender_id,
+                    body=zlib.compress(text.encode('utf-8')),
+                    created_at=created_at,
+                )
+                for message_id, thread_id, sender_id, text, created_at in rows
+            ])
+            # Sync clients must not see archived messages as deleted.
+            with changes.paused():
+                Message.objects.filter(id__in=[row[0] for row in rows]).delete()
+        moved += len(rows)
+
+
+def message_sources(thread_id):
+    """
+    The thread's archived and hot messages, oldest first: every archived message predates every hot one.
+    """
+    return [
+        ArchivedMessage.objects.filter(thread_id=thread_id).select_related('sender'),
+        Message.objects.filter(thread_id=thread_id).select_related('sender'),
+    ]
+
+
+def _pivot(sources, message_id):
+    for source in reversed(sources):
+        created_at = source.filter(pk=message_id).values_list('created_at', flat=True).first()
+        if created_at is not None:
+            return created_at
+    return None
+
+
+def history_page(sources, limit, before=None, after=None):
+    """
+    Up to `limit` messages right after `after`, right before `before`, or the newest ones,
+    read from `sources` (see message_sources()) in turn until the page is full.
+    Results are in chronological order.
+    """
+    cursor = after if after is not None else before
+    keyset = Q()
+    if cursor is not None:
+        pivot = _pivot(sources, cursor)
+        if pivot is None:
+            return []
+        if after is not None:
+            keyset = Q(created_at__gt=pivot) | Q(created_at=pivot, id__gt=after)
+        else:
+            keyset = Q(created_at__lt=pivot) | Q(created_at=pivot, id__lt=before)
+
+    if after is not None:
+        order = ('created_at', 'id')
+    else:
+        order, sources = ('-created_at', '-id'), sources[::-1]
+
+    rows = []
+    for source in sources:
+        rows += source.filter(keyset).order_by(*order)[:limit - len(rows)]
+        if len(rows) >= limit:
+            break
+    return rows if after is not None else rows[::-1]
@@ -0,0 +1,126 @@
+"""
+Change sequence for delta sync (see the `sync/` endpoint).
+
+Every change a chat client cares about appends a ChangeEvent: new and deleted
+messages, read cursor moves and new threads are scoped to their thread, link
+changes get one row per user involved. Clients keep the id of the last event
+they applied and ask for what came after it.
+
+Ids are handed out at insert time but become visible at commit, so a slow
+transaction can surface an id lower than one a client already has. The cursor
+returned by changes_since() therefore never moves past events younger than
+SYNC_SETTLE_SECONDS; those are sent again on the next sync, which is harmless
+since every entry describes current state.
+
+The sequence is pruned to SYNC_RETENTION_DAYS (see the `archive_messages`
+command). A cursor from before the oldest kept event is expired: the client
+has to reload in full and start over from latest_cursor().
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .models import ChangeEvent, Thread
+
+
+_paused = ContextVar('sync_changes_paused', default=False)
+
+
+@contextmanager
+def paused():
+    """
+    Nothing is recorded inside the block; for moves clients must not see, such as archiving.
+    """
+    token = _paused.set(True)
+    try:
+        yield
+    finally:
+        _paused.reset(token)
+
+
+def record_messages(messages, kind='message'):
+    if _paused.get():
+        return
+    ChangeEvent.objects.bulk_create([
+        ChangeEvent(kind=kind, object_id=message.id, thread_id=message.thread_id) for message in messages
+    ])
+
+
+def record_thread(thread_id):
+    if _paused.get():
+        return
+    ChangeEvent.objects.create(kind='thread', object_id=thread_id, thread_id=thread_id)
+
+
+def record_link(link, deleted=False):
+    if _paused.get():
+        return
+    kind = 'link_deleted' if deleted else 'link'
+    ChangeEvent.objects.bulk_create([
+        ChangeEvent(kind=kind, object_id=link.id, user_id=user_id)
+        for user_id in {link.from_user_id, link.to_user_id} if user_id
+    ])
+
+
+def visible_to(user):
+    return ChangeEvent.objects.filter(
+        Q(thread__in=Thread.objects.filter(participants=user).values('id')) | Q(user=user)
+    )
+
+
+def _settled_before():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'SYNC_SETTLE_SECONDS', 2))
+
+
+def latest_cursor(user):
+    """
+    The cursor to start syncing from after a full load. Like changes_since(), it stays
+    short of events younger than SYNC_SETTLE_SECONDS, so the first sync sends them.
+    """
+    # Across all users, so the created_at index serves it; stopping early only resends a few events.
+    first_unsettled = (
+        ChangeEvent.objects.filter(created_at__gt=_settled_before()).aggregate(first=Min('id'))['first']
+    )
+    events = visible_to(user)
+    if first_unsettled is not None:
+        events = events.filter(id__lt=first_unsettled)
+    return events.aggregate(last=Max('id'))['last'] or 0
+
+
+def expired(since):
+    """
+    True when events after `since` may already have been pruned.
+    """
+    oldest = ChangeEvent.objects.aggregate(oldest=Min('id'))['oldest']
+    return oldest is not None and since < oldest - 1
+
+
+def prune(days=None):
+    """
+    Deletes events older than SYNC_RETENTION_DAYS. Returns the number of events deleted.
+    """
+    if days is None:
+        days = getattr(settings, 'SYNC_RETENTION_DAYS', 30)
+    deleted, _ = ChangeEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+def changes_since(user, since, limit):
+    """
+    Returns (events, next cursor, has_more) for events after `since`, oldest first.
+    """
+    events = list(visible_to(user).filter(id__gt=since).order_by('id')[:limit + 1])
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    settled_before = _settled_before()
+    cursor = since
+    for event in events:
+        if event.created_at > settled_before:
+            break
+        cursor = event.id
+    return events, cursor, has_more
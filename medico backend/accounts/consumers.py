@@ -1,17 +1,33 @@
-import json
+import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync , sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from .models import Thread, Message, UserLink
+from django.db.models import Max, Q
+from .models import Thread, Message, ThreadReadState, UserLink
 from .serializers import MessageSerializer
+from . import message_queue, presence, frames
+from .frames import NegotiatedFramesMixin
 
 User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def message_payload(message, read_by_ids, temp_id=None):
+    return {
+        "id": message.id,
+        "thread": message.thread_id,
+        "sender_id": message.sender_id,
+        "sender_username": message.sender.username,
+        "message": message.text,
+        "created_at": message.created_at.isoformat(),
+        "read_by": read_by_ids,
+        "tempId": temp_id,
+    }
+
+
+class ChatConsumer(NegotiatedFramesMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope.get("user")
         self.thread_id = self.scope["url_route"]["kwargs"]["thread_id"]
@@ -29,7 +45,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        if not await sync_to_async(self.is_participant)():
+        self.participant_ids = await sync_to_async(self.get_participant_ids)()
+
+        if not self.is_participant():
             print(f"❌ [CONNECT] Rejected: {self.user} not participant in thread {self.thread_id}")
             await self.close()
             return
@@ -41,43 +59,71 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         self.room_group_name = f"chat_{self.thread_id}"
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_negotiated()
 
         print(f"✅ [CONNECT] {self.user} connected to {self.room_group_name}")
 
-        unread_messages = await sync_to_async(
-            lambda: list(self.thread.messages.exclude(read_by=self.user))
-        )()
+        unread_messages, has_more = await sync_to_async(self.get_unread_messages)()
 
         print(f"📨 [UNREAD] Sending {len(unread_messages)} unread messages to {self.user}")
 
-        for msg in unread_messages:
-            read_by_ids = await sync_to_async(lambda: list(msg.read_by.values_list("id", flat=True)))()
-            await self.send(
-                text_data=json.dumps({
-                    "id": msg.id,
-                    "thread": msg.thread.id,
-                    "sender_id": await sync_to_async(lambda: msg.sender.id)(),
-                    "sender_username": await sync_to_async(lambda: msg.sender.username)(),
-                    "message": msg.text,
-                    "created_at": msg.created_at.isoformat(),
-                    "read_by": read_by_ids,
-                    "tempId": None,
-                })
-            )
+        chunk_size = getattr(settings, "CHAT_REPLAY_CHUNK_SIZE", 100)
+        for start in range(0, len(unread_messages), chunk_size):
+            await self.send_frame({
+                "type": "history",
+                "messages": unread_messages[start:start + chunk_size],
+                "has_more": has_more,
+            }, compressible=True)
+
+        await sync_to_async(presence.connected)(self.user.id)
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {"type": "user_presence", "user_id": self.user.id, "online": True},
+        )
+        online = await sync_to_async(presence.online_ids)(self.participant_ids)
+        await self.send_frame({"type": "presence", "online": online})
 
     async def disconnect(self, close_code):
+        if getattr(self, "read_flush_task", None) is not None:
+            self.read_flush_task.cancel()
+            self.read_flush_task = None
+        if getattr(self, "typing_task", None) is not None:
+            self.typing_task.cancel()
+            self.typing_task = None
+        if getattr(self, "pending_read_up_to", None):
+            await self.flush_read()
+        if message_queue.enabled():
+            # Connections close on shutdown too; don't leave their messages buffered.
+            await message_queue.get_queue().flush()
         if hasattr(self, "room_group_name"):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            if await sync_to_async(presence.disconnected)(self.user.id):
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {"type": "user_presence", "user_id": self.user.id, "online": False},
+                )
             print(f"🔌 [DISCONNECT] {self.user} disconnected from {self.room_group_name}")
         else:
             print("⚠️ [DISCONNECT] No room group to discard (probably failed early connect)")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = self.codec.decode(text_data, bytes_data)
+            if data.get("type") == "read":
+                await self.queue_read(int(data["up_to"]))
+                return
+            if data.get("type") == "heartbeat":
+                await sync_to_async(presence.heartbeat)(self.user.id)
+                return
+            if data.get("type") == "typing":
+                await self.relay_typing(bool(data.get("typing", True)))
+                return
             message_text = data.get("message", "").strip()
             temp_id = data.get("tempId")
+        except frames.FrameTooLarge as e:
+            print(f"❌ [RECEIVE] {e}; closing")
+            await self.close(code=1009)
+            return
         except Exception as e:
             print(f"❌ [RECEIVE] Invalid JSON: {e}")
             return
@@ -88,20 +134,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         print(f"💬 [RECEIVE] Message from {self.user}: {message_text}")
 
-        message = await sync_to_async(self.save_message)(message_text)
-
-        read_by_ids = await sync_to_async(lambda: list(message.read_by.values_list("id", flat=True)))()
+        if message_queue.enabled():
+            # Broadcast first; the row is written by the next batched flush.
+            message = await sync_to_async(message_queue.build_message)(self.thread, self.user, message_text)
+            read_by_ids = [self.user.id]
+        else:
+            message = await sync_to_async(self.save_message)(message_text)
+            read_by_ids = await sync_to_async(message.read_by_ids)()
 
-        serialized_message = {
-            "id": message.id,
-            "thread": message.thread.id,
-            "sender_id": message.sender.id,
-            "sender_username": message.sender.username,
-            "message": message.text,
-            "created_at": message.created_at.isoformat(),
-            "read_by": read_by_ids,
-            "tempId": temp_id,
-        }
+        serialized_message = message_payload(message, read_by_ids, temp_id)
 
         print(f"📤 [BROADCAST] Message {message.id} from {self.user} to group {self.room_group_name}")
 
@@ -110,18 +151,92 @@ class ChatConsumer(AsyncWebsocketConsumer):
             {"type": "chat_message", "message": serialized_message},
         )
 
+        if message_queue.enabled():
+            await message_queue.get_queue().put(message)
+
+    async def queue_read(self, up_to):
+        """
+        Coalesces {"type": "read", "up_to": <id>} frames: only the highest id seen within
+        CHAT_READ_COALESCE_MS is written and broadcast.
+        """
+        self.pending_read_up_to = max(getattr(self, "pending_read_up_to", None) or 0, up_to)
+        if getattr(self, "read_flush_task", None) is None:
+            self.read_flush_task = asyncio.ensure_future(self.flush_read_later())
+
+    async def flush_read_later(self):
+        await asyncio.sleep(getattr(settings, "CHAT_READ_COALESCE_MS", 500) / 1000)
+        self.read_flush_task = None
+        await self.flush_read()
+
+    async def flush_read(self):
+        up_to, self.pending_read_up_to = self.pending_read_up_to, None
+        if not up_to:
+            return
+        read_up_to = await sync_to_async(self.save_read)(up_to)
+        if read_up_to:
+            print(f"👁 [READ] {self.user} read thread {self.thread_id} up to {read_up_to}")
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {"type": "read_receipt", "user_id": self.user.id, "up_to": read_up_to},
+            )
+
+    async def relay_typing(self, typing):
+        """
+        Changes of typing state go out at once; throttled repeats are replaced by one
+        trailing frame carrying the latest state when the throttle window ends.
+        """
+        self.typing_state = typing
+        delay = await sync_to_async(presence.typing_delay)(self.user.id, self.thread_id, typing)
+        if delay:
+            if getattr(self, "typing_task", None) is None:
+                self.typing_task = asyncio.ensure_future(self.relay_typing_later(delay))
+            return
+        if getattr(self, "typing_task", None) is not None:
+            # The latest state is going out now; nothing left to trail.
+            self.typing_task.cancel()
+            self.typing_task = None
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {"type": "user_typing", "user_id": self.user.id, "username": self.user.username, "typing": typing},
+        )
+
+    async def relay_typing_later(self, delay):
+        await asyncio.sleep(delay)
+        self.typing_task = None
+        await self.relay_typing(self.typing_state)
+
+    async def user_presence(self, event):
+        if event["user_id"] == self.user.id:
+            return
+        await self.send_frame({
+            "type": "presence",
+            "user_id": event["user_id"],
+            "online": event["online"],
+        })
+
+    async def user_typing(self, event):
+        if event["user_id"] == self.user.id:
+            return
+        await self.send_frame({
+            "type": "typing",
+            "user_id": event["user_id"],
+            "username": event["username"],
+            "typing": event["typing"],
+        })
+
     async def chat_message(self, event):
         message = event["message"]
         print(f"📩 [SEND] Sending message {message['id']} to {self.user}")
-        await self.send(text_data=json.dumps(message))
+        await self.send_frame(message)
 
     async def read_receipt(self, event):
-        print(f"👁 [READ] User {event['user_id']} read messages {event['message_ids']}")
-        await self.send(text_data=json.dumps({
+        print(f"👁 [READ] User {event['user_id']} read messages up to {event.get('up_to')}")
+        await self.send_frame({
             "type": "read_receipt",
             "user_id": event["user_id"],
-            "message_ids": event["message_ids"],
-        }))
+            "message_ids": event.get("message_ids", []),
+            "up_to": event.get("up_to"),
+        })
 
     def get_thread(self):
         try:
@@ -129,25 +244,59 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Thread.DoesNotExist:
             return None
 
+    def get_participant_ids(self):
+        return set(self.thread.participants.values_list("id", flat=True))
+
     def is_participant(self):
-        return self.user in self.thread.participants.all()
+        return self.user.id in self.participant_ids
 
     def has_accepted_link(self):
-        other_users = self.thread.participants.exclude(id=self.user.id)
-        for other in other_users:
-            if not UserLink.objects.filter(
-                Q(from_user=self.user, to_user=other) | Q(from_user=other, to_user=self.user),
-                status="accepted",
-            ).exists():
-                return False
-        return True
+        other_ids = self.participant_ids - {self.user.id}
+        if not other_ids:
+            return True
+        links = UserLink.objects.filter(
+            Q(from_user=self.user, to_user_id__in=other_ids) | Q(to_user=self.user, from_user_id__in=other_ids),
+            status="accepted",
+        ).values_list("from_user_id", "to_user_id")
+        return other_ids <= {to_id if from_id == self.user.id else from_id for from_id, to_id in links}
+
+    def get_unread_messages(self):
+        """
+        Serialized unread messages, oldest first, capped at the newest CHAT_REPLAY_LIMIT.
+        Returns (messages, has_more); older unread messages are left to the history API.
+        """
+        limit = getattr(settings, "CHAT_REPLAY_LIMIT", 200)
+        read_cursors = list(
+            ThreadReadState.objects.filter(thread=self.thread)
+            .order_by("user_id")
+            .values_list("user_id", "last_read_message_id")
+        )
+        own_cursor = next((cursor for user_id, cursor in read_cursors if user_id == self.user.id), 0)
+        unread = list(
+            self.thread.messages.filter(id__gt=own_cursor)
+            .exclude(sender=self.user)
+            .select_related("sender")
+            .order_by("-created_at", "-id")[:limit + 1]
+        )
+        has_more = len(unread) > limit
+        return [
+            message_payload(msg, [user_id for user_id, cursor in read_cursors if cursor >= msg.id])
+            for msg in reversed(unread[:limit])
+        ], has_more
+
+    def save_read(self, up_to):
+        # Clamp to a message that exists in this thread; returns the new cursor or None if it didn't move.
+        last_id = self.thread.messages.filter(id__lte=up_to).aggregate(last=Max("id"))["last"]
+        if last_id and ThreadReadState.advance(self.thread.id, self.user.id, last_id):
+            return last_id
+        return None
 
     def save_message(self, text):
         msg = Message.objects.create(thread=self.thread, sender=self.user, text=text)
-        msg.read_by.add(self.user)
+        msg.advance_sender_cursor()
         return msg
       
-class AppointmentConsumer(AsyncWebsocketConsumer):
+class AppointmentConsumer(NegotiatedFramesMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope.get("user")
         if not user or user.is_anonymous:
@@ -157,10 +306,10 @@ class AppointmentConsumer(AsyncWebsocketConsumer):
         self.group_name = f"appointments_user_{user.id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
 
-        await self.accept()
-        await self.send(json.dumps({
+        await self.accept_negotiated()
+        await self.send_frame({
             "message": f"Connected to appointment notifications for user {user.id}!"
-        }))
+        })
 
     async def disconnect(self, close_code):
         if hasattr(self, "group_name"):
@@ -168,11 +317,11 @@ class AppointmentConsumer(AsyncWebsocketConsumer):
 
     async def appointment_event(self, event):
         # Send event to client
-        await self.send(json.dumps({
+        await self.send_frame({
             "event": event["event"],
             "appointment": event["appointment"],
             "target": event.get("target", "unknown"),
-        }))
+        })
 
 
 
@@ -187,3 +336,18 @@ def notify_appointment(user_id, event_type, appointment_data, target=None):
             "target": target or "user",  # patient | doctor
         }
     )
+
+
+def notify_read_receipt(thread_id, user_id, up_to):
+    """
+    One coalesced receipt for everything in the thread up to (and including) message `up_to`.
+    """
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f"chat_{thread_id}",
+        {
+            "type": "read_receipt",
+            "user_id": user_id,
+            "up_to": up_to,
+        }
+    )
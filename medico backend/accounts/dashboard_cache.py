@@ -0,0 +1,95 @@
+"""
+Per-user cache for DashboardViewSet responses.
+
+Entries are keyed by (user id, action, query params) plus a version token per
+scope. Invalidation swaps the token, which orphans every entry of that scope
+at once; orphaned entries simply expire with DASHBOARD_CACHE_TIMEOUT.
+
+Tokens live in the cache, so invalidation reaches other workers only when the
+cache is shared (Redis when REDIS_CACHE_URL is set; `check --deploy` warns otherwise).
+With a per-process cache, other workers serve stale dashboards for up to the
+timeout, which is why it stays short.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+ALL_SCOPE = 'all'
+HITS_KEY = 'dashboard:stats:hits'
+MISSES_KEY = 'dashboard:stats:misses'
+
+
+def _timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 60)
+
+
+def _version_key(scope):
+    return f'dashboard:version:{scope}'
+
+
+def _versions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = uuid.uuid4().hex
+            cache.set(key, versions[key], None)
+    return ':'.join(versions[key] for key in keys)
+
+
+def _scopes_for(user):
+    # Admin dashboards aggregate over everyone, so they also follow the global version.
+    if user.role == 'admin':
+        return [user.id, ALL_SCOPE]
+    return [user.id]
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def cache_key(user, action, params):
+    encoded = '&'.join(f'{name}={value}' for name, value in sorted(params.items()))
+    digest = hashlib.md5(encoded.encode()).hexdigest()
+    return f'dashboard:{action}:{user.id}:{_versions(_scopes_for(user))}:{digest}'
+
+
+def get_or_compute(user, action, params, compute):
+    """
+    Returns (data, status). Only successful (200) results are cached.
+    """
+    key = cache_key(user, action, params)
+    data = cache.get(key)
+    if data is not None:
+        _incr(HITS_KEY)
+        return data, 200
+
+    _incr(MISSES_KEY)
+    data, status = compute()
+    if status == 200:
+        cache.set(key, data, _timeout())
+    return data, status
+
+
+def invalidate(*user_ids, everyone=False):
+    """
+    Drops cached dashboards of the given users (and of admins when everyone=True)
+    once the current transaction commits.
+    """
+    scopes = {user_id for user_id in user_ids if user_id}
+    if everyone:
+        scopes.add(ALL_SCOPE)
+    if scopes:
+        transaction.on_commit(lambda: cache.delete_many([_version_key(scope) for scope in scopes]))
+
+
+def stats():
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': counters.get(HITS_KEY, 0), 'misses': counters.get(MISSES_KEY, 0)}
@@ -0,0 +1,141 @@
+"""
+Negotiated wire encoding for the chat and appointment sockets.
+
+JSON text frames stay the default. A client asks for MessagePack with
+`?encoding=msgpack` or the `msgpack` WebSocket subprotocol; frames are then
+binary, with field names shortened through FIELD_CODES (applied at every level).
+Adding `?compress=deflate` (or the `msgpack+deflate` subprotocol) also deflates
+large batched frames such as history replays. Every binary frame starts with one
+flag byte: 0 for plain MessagePack, 1 for deflated MessagePack.
+
+Inbound frames, inflated or not, may not exceed WS_MAX_INBOUND_FRAME_BYTES;
+decode() raises FrameTooLarge past that, without inflating further.
+
+msgpack is optional; without it every client gets JSON.
+"""
+import json
+import logging
+import zlib
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+PLAIN = 0
+DEFLATED = 1
+
+FIELD_CODES = {
+    'type': 'y',
+    'id': 'i',
+    'thread': 't',
+    'sender_id': 's',
+    'sender_username': 'u',
+    'message': 'm',
+    'messages': 'ms',
+    'created_at': 'c',
+    'read_by': 'r',
+    'tempId': 'k',
+    'has_more': 'h',
+    'user_id': 'ui',
+    'username': 'un',
+    'up_to': 'up',
+    'message_ids': 'mi',
+    'online': 'o',
+    'typing': 'ty',
+    'event': 'e',
+    'appointment': 'a',
+    'target': 'tg',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+
+def _rename(value, table):
+    if isinstance(value, dict):
+        return {table.get(key, key): _rename(item, table) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rename(item, table) for item in value]
+    return value
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+def _max_inbound():
+    return getattr(settings, 'WS_MAX_INBOUND_FRAME_BYTES', 64 * 1024)
+
+
+class FrameCodec:
+    def __init__(self, binary=False, deflate=False):
+        self.binary = binary
+        self.deflate = binary and deflate
+
+    def encode(self, payload, compressible=False):
+        """
+        Keyword arguments for AsyncWebsocketConsumer.send().
+        """
+        if not self.binary:
+            return {'text_data': json.dumps(payload)}
+        packed = msgpack.packb(_rename(payload, FIELD_CODES), use_bin_type=True)
+        if self.deflate and compressible and len(packed) >= getattr(settings, 'WS_DEFLATE_MIN_BYTES', 1024):
+            return {'bytes_data': bytes([DEFLATED]) + zlib.compress(packed)}
+        return {'bytes_data': bytes([PLAIN]) + packed}
+
+    def decode(self, text_data=None, bytes_data=None):
+        limit = _max_inbound()
+        if len(text_data if bytes_data is None else bytes_data) > limit:
+            raise FrameTooLarge(f'Frame exceeds {limit} bytes')
+        if bytes_data is None:
+            return json.loads(text_data)
+        if msgpack is None or not bytes_data:
+            raise ValueError('Binary frames are not supported')
+        flag, body = bytes_data[0], bytes_data[1:]
+        if flag == DEFLATED:
+            inflater = zlib.decompressobj()
+            body = inflater.decompress(body, limit)
+            if inflater.unconsumed_tail:
+                raise FrameTooLarge(f'Frame inflates past {limit} bytes')
+        return _rename(msgpack.unpackb(body, raw=False), FIELD_NAMES)
+
+
+def negotiate(scope):
+    """
+    Returns (codec, subprotocol to accept or None) for a connecting socket.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    subprotocols = scope.get('subprotocols') or []
+    wants_msgpack = query.get('encoding', [''])[0] == 'msgpack'
+    deflate = query.get('compress', [''])[0] == 'deflate'
+
+    subprotocol = None
+    for offered in subprotocols:
+        if offered in ('msgpack', 'msgpack+deflate'):
+            subprotocol = offered
+            wants_msgpack = True
+            deflate = deflate or offered == 'msgpack+deflate'
+            break
+
+    if wants_msgpack and msgpack is None:
+        logger.warning("Client asked for msgpack frames but msgpack is not installed; using JSON.")
+        return FrameCodec(), None
+    return FrameCodec(binary=wants_msgpack, deflate=deflate), subprotocol
+
+
+class NegotiatedFramesMixin:
+    """
+    For AsyncWebsocketConsumer subclasses: accept with the negotiated encoding and send through it.
+    """
+    codec = FrameCodec()
+
+    async def accept_negotiated(self):
+        self.codec, subprotocol = negotiate(self.scope)
+        await self.accept(subprotocol)
+
+    async def send_frame(self, payload, compressible=False):
+        await self.send(**self.codec.encode(payload, compressible))
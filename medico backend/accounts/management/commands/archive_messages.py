@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts import archive, changes
+
+
+class Command(BaseCommand):
+    help = ("Move chat messages older than the retention horizon into the compressed archive table "
+            "and prune the sync change log.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Retention horizon in days (default: MESSAGE_RETENTION_DAYS).")
+        parser.add_argument('--batch-size', type=int, help="Messages moved per transaction.")
+
+    def handle(self, *args, **options):
+        cutoff = archive.horizon(options['days'])
+        moved = archive.archive_before(cutoff, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} messages created before {cutoff:%Y-%m-%d %H:%M}."))
+        pruned = changes.prune()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {pruned} sync change events."))
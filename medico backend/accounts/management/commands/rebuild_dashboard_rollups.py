@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the dashboard rollup tables from appointments, users and links."
+
+    def handle(self, *args, **options):
+        written = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt dashboard rollups: {written['appointments']} appointment rows, "
+            f"{written['patients']} patient rows, {written['links']} link rows."
+        ))
@@ -0,0 +1,214 @@
+"""
+Write-behind persistence for chat messages (enabled with CHAT_WRITE_BEHIND, PostgreSQL only).
+
+ChatConsumer broadcasts a message as soon as it has an id, then hands it to the
+process-wide queue below. The queue writes pending messages with one bulk_create
+once CHAT_WRITE_BEHIND_BATCH_SIZE messages are waiting or CHAT_WRITE_BEHIND_INTERVAL_MS
+after the first one arrived, whichever comes first. Flushes run one at a time and
+in arrival order; whatever is still pending when the process exits is written by
+an atexit hook.
+
+When a batch fails, its messages are written one by one so a single bad row (a
+thread deleted meanwhile, say) cannot hold back the rest. A message that still
+fails is retried on later flushes, up to CHAT_WRITE_BEHIND_MAX_ATTEMPTS writes in
+all, and is then dropped to the `accounts.message_queue.dead_letter` log.
+
+Ids are reserved up front from the table's sequence so that broadcast and stored
+ids match and read cursors keep working. Only PostgreSQL has a sequence that the
+regular insert path shares, so other backends always write synchronously.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Message
+from . import changes
+
+logger = logging.getLogger(__name__)
+dead_letter_logger = logging.getLogger(f'{__name__}.dead_letter')
+
+_warned_backend = False
+
+
+def enabled():
+    global _warned_backend
+    if not getattr(settings, 'CHAT_WRITE_BEHIND', False):
+        return False
+    if connection.vendor != 'postgresql':
+        if not _warned_backend:
+            logger.warning("CHAT_WRITE_BEHIND needs PostgreSQL; writing chat messages synchronously.")
+            _warned_backend = True
+        return False
+    return True
+
+
+def reserve_id():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [Message._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def build_message(thread, sender, text):
+    """
+    An unsaved Message with its final id and timestamp, ready to broadcast.
+    """
+    return Message(id=reserve_id(), thread=thread, sender=sender, text=text, created_at=timezone.now())
+
+
+def write_messages(messages):
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        # bulk_create skips post_save, so the sync sequence is fed here.
+        changes.record_messages(messages)
+        for message in sorted(messages, key=lambda message: message.id):
+            message.advance_sender_cursor()
+
+
+def write_each(messages):
+    """
+    Writes messages one transaction each. Returns the ones that failed.
+    """
+    failed = []
+    for message in messages:
+        try:
+            write_messages([message])
+        except Exception:
+            logger.exception("Chat write-behind could not store message %s", message.id)
+            failed.append(message)
+    return failed
+
+
+def dead_letter(message):
+    dead_letter_logger.error(json.dumps({
+        'id': message.id,
+        'thread_id': message.thread_id,
+        'sender_id': message.sender_id,
+        'text': message.text,
+        'created_at': message.created_at.isoformat(),
+    }))
+
+
+class WriteBehindQueue:
+    def __init__(self, batch_size, interval_ms, max_attempts=3):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.max_attempts = max_attempts
+        self._pending = []
+        self._attempts = {}
+        self._flush_lock = None
+        self._timer = None
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.dead_letters = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    async def put(self, message):
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            started = time.monotonic()
+            failed = await sync_to_async(self._write)(batch)
+            self._settle(batch, failed, started)
+
+    def flush_sync(self):
+        batch, self._pending = self._pending, []
+        if batch:
+            started = time.monotonic()
+            self._settle(batch, self._write(batch), started)
+
+    def _write(self, batch):
+        try:
+            write_messages(batch)
+            return []
+        except Exception:
+            self.failures += 1
+            logger.exception("Chat write-behind flush of %s messages failed; writing them one by one", len(batch))
+            return write_each(batch)
+
+    def _settle(self, batch, failed, started):
+        retry = []
+        for message in failed:
+            attempts = self._attempts.get(message.id, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(message.id, None)
+                self.dead_letters += 1
+                dead_letter(message)
+            else:
+                self._attempts[message.id] = attempts
+                retry.append(message)
+        for message in batch:
+            if message not in retry:
+                self._attempts.pop(message.id, None)
+        # Keep retries ahead of anything queued meanwhile.
+        self._pending = retry + self._pending
+        self._record(len(batch) - len(failed), started)
+
+    def _record(self, count, started):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self.flushes += 1
+        self.flushed += count
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    def stats(self):
+        return {
+            'enabled': enabled(),
+            'depth': len(self._pending),
+            'flushes': self.flushes,
+            'flushed_messages': self.flushed,
+            'failures': self.failures,
+            'dead_letters': self.dead_letters,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+        }
+
+
+_queue = None
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue = WriteBehindQueue(
+            batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 50),
+            interval_ms=getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL_MS', 200),
+            max_attempts=getattr(settings, 'CHAT_WRITE_BEHIND_MAX_ATTEMPTS', 3),
+        )
+    return _queue
+
+
+def stats():
+    return get_queue().stats()
+
+
+@atexit.register
+def _flush_on_exit():
+    if _queue is not None and _queue._pending:
+        try:
+            _queue.flush_sync()
+        except Exception:
+            logger.exception("Chat write-behind could not flush %s messages on exit", len(_queue._pending))
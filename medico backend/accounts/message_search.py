@@ -0,0 +1,87 @@
+"""
+Full-text search over chat messages.
+
+On PostgreSQL, migration 0020 adds a generated `search_vector` column
+(to_tsvector('simple', text)) with a GIN index; the database keeps it in sync on
+every insert and update, and matches are highlighted with ts_headline so the
+marks fall on the tokens that matched. Other backends narrow the rows with one
+case-insensitive LIKE per term, keep those where every term is a whole word
+(checked in Python on that smaller set), rank every hit equally and highlight
+the same whole words. Either way all terms must match.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, TextField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Message
+
+SEARCH_CONFIG = 'simple'
+MAX_TERMS = 8
+
+# ts_headline markers; private-use characters, swapped for <mark> once the text is escaped.
+START_SEL, STOP_SEL = '\ue000', '\ue001'
+HEADLINE_OPTIONS = f'StartSel={START_SEL}, StopSel={STOP_SEL}, HighlightAll=true'
+
+
+def terms(query):
+    words = []
+    for word in re.findall(r'\w+', query.lower()):
+        if word not in words:
+            words.append(word)
+    return words[:MAX_TERMS]
+
+
+def _word_pattern(words):
+    alternatives = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return re.compile(rf'\b(?:{alternatives})\b', re.IGNORECASE)
+
+
+def search(queryset, words):
+    """
+    Filters `queryset` to messages matching every word and annotates a float `rank`,
+    plus the ts_headline `headline` on PostgreSQL.
+    """
+    if connection.vendor == 'postgresql':
+        column = f'"{Message._meta.db_table}"."search_vector"'
+        params = [SEARCH_CONFIG, ' '.join(words)]
+        return (
+            queryset
+            .filter(RawSQL(f'{column} @@ plainto_tsquery(%s::regconfig, %s)', params, output_field=BooleanField()))
+            # float8 so the rank round-trips exactly through keyset cursors.
+            .annotate(rank=RawSQL(f'ts_rank({column}, plainto_tsquery(%s::regconfig, %s))::float8', params,
+                                  output_field=FloatField()))
+            .annotate(headline=RawSQL(
+                f'ts_headline(%s::regconfig, "{Message._meta.db_table}"."text", plainto_tsquery(%s::regconfig, %s), %s)',
+                [SEARCH_CONFIG, *params, HEADLINE_OPTIONS], output_field=TextField(),
+            ))
+        )
+
+    for word in words:
+        queryset = queryset.filter(text__icontains=word)
+    patterns = [_word_pattern([word]) for word in words]
+    ids = [
+        pk for pk, text in queryset.values_list('id', 'text')
+        if all(pattern.search(text) for pattern in patterns)
+    ]
+    return queryset.filter(id__in=ids).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def highlight(text, words, headline=None):
+    """
+    HTML-escaped text with the matched search words wrapped in <mark>: the ts_headline
+    `headline` when search() annotated one, otherwise every whole-word occurrence.
+    """
+    if headline is not None:
+        return escape(headline).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+    if not words:
+        return escape(text)
+    pattern = _word_pattern(words)
+    parts, last = [], 0
+    for match in pattern.finditer(text):
+        parts += [escape(text[last:match.start()]), '<mark>', escape(match.group()), '</mark>']
+        last = match.end()
+    parts.append(escape(text[last:]))
+    return ''.join(parts)
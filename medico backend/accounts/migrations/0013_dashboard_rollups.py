@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_alter_appointment_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('all', 'All'), ('doctor', 'Doctor'), ('patient', 'Patient')], max_length=10)),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('scope_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scope', 'scope_user', 'day', 'status'), name='uniq_appointment_stat'), models.UniqueConstraint(condition=models.Q(('scope_user__isnull', True)), fields=('scope', 'day', 'status'), name='uniq_appointment_stat_global')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientMonthlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('all', 'All'), ('doctor', 'Doctor'), ('patient', 'Patient')], max_length=10)),
+                ('month', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('scope_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scope', 'scope_user', 'month'), name='uniq_patient_stat'), models.UniqueConstraint(condition=models.Q(('scope_user__isnull', True)), fields=('scope', 'month'), name='uniq_patient_stat_global')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserLinkDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(choices=[('sent', 'Sent'), ('received', 'Received')], max_length=10)),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'direction', 'day', 'status'), name='uniq_userlink_stat')],
+            },
+        ),
+    ]
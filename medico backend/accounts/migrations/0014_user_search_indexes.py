@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+SEARCH_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def create_name_search_indexes(apps, schema_editor):
+    # istartswith compiles to UPPER(col::text) LIKE UPPER(...) on PostgreSQL,
+    # which a trigram GIN index on the same expression can serve. Other backends
+    # scan the table for these lookups (SQLite's LIKE ... ESCAPE can't use a plain index).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS user_{field}_trgm_idx ON accounts_user '
+            f'USING gin (UPPER({field}::text) gin_trgm_ops)'
+        )
+
+
+def drop_name_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS user_{field}_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_dashboard_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['role'], name='user_role_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['country'], name='user_country_idx'),
+        ),
+        migrations.RunPython(create_name_search_indexes, drop_name_search_indexes),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userlink',
+            index=models.Index(fields=['to_user', 'status', 'created_at'], name='userlink_to_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlink',
+            index=models.Index(fields=['from_user', 'status', 'updated_at'], name='userlink_from_status_idx'),
+        ),
+    ]
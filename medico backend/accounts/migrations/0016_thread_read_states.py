@@ -0,0 +1,75 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def read_by_to_cursors(apps, schema_editor):
+    # A user's cursor becomes the newest message they had marked as read in each thread.
+    Message = apps.get_model('accounts', 'Message')
+    ThreadReadState = apps.get_model('accounts', 'ThreadReadState')
+    now = timezone.now()
+    rows = (
+        Message.read_by.through.objects
+        .values('message__thread_id', 'user_id')
+        .annotate(last=Max('message_id'))
+        .order_by()
+    )
+    ThreadReadState.objects.bulk_create(
+        (
+            ThreadReadState(
+                thread_id=row['message__thread_id'],
+                user_id=row['user_id'],
+                last_read_message_id=row['last'],
+                last_read_at=now,
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+def cursors_to_read_by(apps, schema_editor):
+    Message = apps.get_model('accounts', 'Message')
+    ThreadReadState = apps.get_model('accounts', 'ThreadReadState')
+    through = Message.read_by.through
+    for state in ThreadReadState.objects.iterator():
+        message_ids = Message.objects.filter(
+            thread_id=state.thread_id, id__lte=state.last_read_message_id
+        ).values_list('id', flat=True)
+        through.objects.bulk_create(
+            [through(message_id=message_id, user_id=state.user_id) for message_id in message_ids],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_userlink_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='accounts.thread')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('thread', 'user')},
+            },
+        ),
+        migrations.RunPython(read_by_to_cursors, cursors_to_read_by),
+        migrations.RemoveField(
+            model_name='message',
+            name='read_by',
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merged_cursor(Message, threads, user_id, cursors):
+    """
+    Read cursor over the merged threads that doesn't hide anything that was unread:
+    everything before the earliest unread message (in any of the threads) stays read.
+    """
+    first_unread = []
+    for thread_id in threads:
+        message_id = (
+            Message.objects.filter(thread_id=thread_id, id__gt=cursors.get(thread_id, 0))
+            .exclude(sender_id=user_id)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if message_id is not None:
+            first_unread.append(message_id)
+    if first_unread:
+        return min(first_unread) - 1
+    return max(cursors.values())
+
+
+def backfill_direct_threads(apps, schema_editor):
+    Thread = apps.get_model('accounts', 'Thread')
+    Message = apps.get_model('accounts', 'Message')
+    ThreadReadState = apps.get_model('accounts', 'ThreadReadState')
+    Participant = Thread.participants.through
+
+    two_person = (
+        Thread.objects.annotate(n=Count('participants', distinct=True)).filter(n=2).values_list('id', flat=True)
+    )
+    pairs = defaultdict(list)
+    for thread_id, user_id in (
+        Participant.objects.filter(thread_id__in=list(two_person))
+        .order_by('thread_id', 'user_id')
+        .values_list('thread_id', 'user_id')
+    ):
+        pairs[thread_id].append(user_id)
+    by_key = defaultdict(list)
+    for thread_id, user_ids in pairs.items():
+        by_key[tuple(user_ids)].append(thread_id)
+
+    for (min_user_id, max_user_id), thread_ids in by_key.items():
+        # The oldest thread survives; duplicates are folded into it.
+        keep, duplicates = min(thread_ids), sorted(thread_ids)[1:]
+        if duplicates:
+            for user_id in (min_user_id, max_user_id):
+                cursors = dict(
+                    ThreadReadState.objects.filter(thread_id__in=thread_ids, user_id=user_id)
+                    .values_list('thread_id', 'last_read_message_id')
+                )
+                if cursors:
+                    cursor = merged_cursor(Message, thread_ids, user_id, cursors)
+                    ThreadReadState.objects.update_or_create(
+                        thread_id=keep, user_id=user_id, defaults={'last_read_message_id': cursor}
+                    )
+            Message.objects.filter(thread_id__in=duplicates).update(thread_id=keep)
+            Thread.objects.filter(id__in=duplicates).delete()
+        Thread.objects.filter(id=keep).update(min_user_id=min_user_id, max_user_id=max_user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_message_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='max_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='min_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_direct_threads, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='thread',
+            constraint=models.UniqueConstraint(condition=models.Q(('max_user__isnull', False), ('min_user__isnull', False)), fields=('min_user', 'max_user'), name='unique_direct_thread'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:31
+
+from django.db import migrations
+
+
+def create_search_vector(apps, schema_editor):
+    # A generated column is maintained by PostgreSQL itself on insert and update,
+    # bulk_create included. Other backends search with LIKE plus a whole-word check
+    # in Python (see accounts.message_search) and need nothing here.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "ALTER TABLE accounts_message ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, coalesce(text, ''))) STORED"
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS message_search_vector_idx ON accounts_message USING gin (search_vector)'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS message_search_vector_idx')
+    schema_editor.execute('ALTER TABLE accounts_message DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0019_direct_thread_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
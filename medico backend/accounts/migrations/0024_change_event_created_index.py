@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0023_backfill_dashboard_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['created_at'], name='change_created_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
+import zlib
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 
 from django_countries.fields import CountryField
 from phonenumber_field.modelfields import PhoneNumberField
@@ -23,6 +26,12 @@ class User(AbstractUser):
     city = models.CharField(max_length=100, blank=True, null=True)
     phone = PhoneNumberField(blank=True, null=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['role'], name='user_role_idx'),
+            models.Index(fields=['country'], name='user_country_idx'),
+        ]
+
     def save(self, *args, **kwargs):
        
         super().save(*args, **kwargs)
@@ -114,6 +123,12 @@ class UserLink(models.Model):
 
     class Meta:
         unique_together = ('from_user', 'to_user', 'link_type')
+        # The unique index already leads with (from_user, to_user), which serves
+        # the symmetric pair lookups; these cover the per-side status filters.
+        indexes = [
+            models.Index(fields=['to_user', 'status', 'created_at'], name='userlink_to_status_idx'),
+            models.Index(fields=['from_user', 'status', 'updated_at'], name='userlink_from_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.from_user.username} → {self.to_user.username} ({self.link_type}, {self.status})"
@@ -124,12 +139,52 @@ class Thread(models.Model):
         settings.AUTH_USER_MODEL,
         related_name='chat_threads'
     )
+    # Canonical key of 1:1 threads: the two participants ordered by id. Empty for other threads.
+    min_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    max_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['min_user', 'max_user'],
+                condition=models.Q(min_user__isnull=False, max_user__isnull=False),
+                name='unique_direct_thread',
+            ),
+        ]
+
     def __str__(self):
         names = ', '.join([user.username for user in self.participants.all()])
         return f"Thread ({names})"
 
+    @classmethod
+    def get_or_create_direct(cls, user, other_user):
+        """
+        The 1:1 thread between two users, created on first use. Returns (thread, created).
+        """
+        min_user_id, max_user_id = sorted((user.id, other_user.id))
+        with transaction.atomic():
+            thread, created = cls.objects.get_or_create(min_user_id=min_user_id, max_user_id=max_user_id)
+            if created:
+                thread.participants.add(min_user_id, max_user_id)
+        return thread, created
+
+    def unread_for(self, user):
+        cursor = self.read_states.filter(user=user).values_list('last_read_message_id', flat=True).first() or 0
+        return self.messages.filter(id__gt=cursor).exclude(sender=user).count()
+
 class Article(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
@@ -153,25 +208,263 @@ class Message(models.Model):
         on_delete=models.CASCADE
     )
     text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind persistence stores the time the message was sent.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['thread', 'created_at', 'id'], name='message_thread_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender.username}: {self.text[:50]}"
 
     
-    read_by = models.ManyToManyField(
+    def mark_as_read(self, user):
+        ThreadReadState.advance(self.thread_id, user.id, self.id)
+
+    def advance_sender_cursor(self):
+        """
+        Moves the sender's read cursor onto this message, unless something from others before
+        it is still unread: sending must not mark incoming messages as read.
+        """
+        cursor = (
+            ThreadReadState.objects.filter(thread_id=self.thread_id, user_id=self.sender_id)
+            .values_list('last_read_message_id', flat=True).first() or 0
+        )
+        unread_before = (
+            Message.objects.filter(thread_id=self.thread_id, id__gt=cursor, id__lt=self.id)
+            .exclude(sender_id=self.sender_id).exists()
+        )
+        return not unread_before and ThreadReadState.advance(self.thread_id, self.sender_id, self.id)
+
+    def read_by_ids(self):
+        """
+        Ids of the users whose read cursor in this thread has reached this message.
+        """
+        return list(
+            ThreadReadState.objects
+            .filter(thread_id=self.thread_id, last_read_message_id__gte=self.id)
+            .order_by('user_id')
+            .values_list('user_id', flat=True)
+        )
+
+
+class ArchivedMessage(models.Model):
+    """
+    Cold storage for messages past the retention horizon (see accounts.archive).
+    Keeps the original id and timestamp so read cursors and history cursors still apply.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        related_name='read_messages',
-        blank=True
+        on_delete=models.CASCADE,
+        related_name='+'
     )
+    # zlib-compressed UTF-8 text.
+    body = models.BinaryField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['thread', 'created_at', 'id'], name='archived_thread_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.sender.username}: {self.text[:50]}"
+        return f"{self.sender_id}: {self.text[:50]}"
 
-    
-    def mark_as_read(self, user):
-        self.read_by.add(user)
+    @property
+    def text(self):
+        return zlib.decompress(bytes(self.body)).decode('utf-8')
+
+
+class ThreadReadState(models.Model):
+    """
+    Per-thread read cursor: everything up to last_read_message_id counts as read by the user.
+    """
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='thread_read_states'
+    )
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('thread', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} read thread {self.thread_id} up to {self.last_read_message_id}"
+
+    @classmethod
+    def advance(cls, thread_id, user_id, message_id):
+        """
+        Moves the user's cursor forward to message_id. Never moves it backwards.
+        Returns True when the cursor moved.
+        """
+        now = timezone.now()
+        updated = cls.objects.filter(
+            thread_id=thread_id, user_id=user_id, last_read_message_id__lt=message_id
+        ).update(last_read_message_id=message_id, last_read_at=now)
+        if not updated:
+            state, updated = cls.objects.get_or_create(
+                thread_id=thread_id,
+                user_id=user_id,
+                defaults={'last_read_message_id': message_id, 'last_read_at': now},
+            )
+        if updated:
+            ChangeEvent.objects.create(kind='read_state', object_id=message_id, thread_id=thread_id, user_id=user_id)
+        return bool(updated)
         
         
         
 
+
+
+class ChangeEvent(models.Model):
+    """
+    Append-only change sequence behind the sync endpoint; the id is the client's cursor.
+    Thread-scoped changes carry the thread, link changes one row per user involved.
+    """
+    KIND_CHOICES = (
+        ('message', 'Message'),
+        ('message_deleted', 'Message deleted'),
+        ('read_state', 'Read state'),
+        ('thread', 'Thread'),
+        ('link', 'Link'),
+        ('link_deleted', 'Link deleted'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', 'id'], name='change_thread_seq_idx'),
+            models.Index(fields=['user', 'id'], name='change_user_seq_idx'),
+            # Finds the unsettled tail for latest_cursor() and the expired head for prune().
+            models.Index(fields=['created_at'], name='change_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.object_id}"
+
+
+# ------------------------------
+# Dashboard rollups
+# ------------------------------
+
+ROLLUP_SCOPES = (
+    ('all', 'All'),
+    ('doctor', 'Doctor'),
+    ('patient', 'Patient'),
+)
+
+
+class AppointmentDailyStat(models.Model):
+    """
+    Appointment counts per (scope, scope user, day, status).
+    The 'all' scope has no scope user and backs the admin dashboard.
+    """
+    scope = models.CharField(max_length=10, choices=ROLLUP_SCOPES)
+    scope_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope', 'scope_user', 'day', 'status'],
+                name='uniq_appointment_stat',
+            ),
+            models.UniqueConstraint(
+                fields=['scope', 'day', 'status'],
+                condition=models.Q(scope_user__isnull=True),
+                name='uniq_appointment_stat_global',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.scope_user_id} {self.day} {self.status} = {self.count}"
+
+
+class PatientMonthlyStat(models.Model):
+    """
+    Patient joins per (scope, scope user, month), month being the first day of the month.
+    """
+    scope = models.CharField(max_length=10, choices=ROLLUP_SCOPES)
+    scope_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    month = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope', 'scope_user', 'month'],
+                name='uniq_patient_stat',
+            ),
+            models.UniqueConstraint(
+                fields=['scope', 'month'],
+                condition=models.Q(scope_user__isnull=True),
+                name='uniq_patient_stat_global',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.scope_user_id} {self.month} = {self.count}"
+
+
+class UserLinkDailyStat(models.Model):
+    DIRECTIONS = (
+        ('sent', 'Sent'),
+        ('received', 'Received'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    direction = models.CharField(max_length=10, choices=DIRECTIONS)
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'direction', 'day', 'status'],
+                name='uniq_userlink_stat',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.direction} {self.day} {self.status} = {self.count}"
@@ -0,0 +1,81 @@
+"""
+Ephemeral chat presence and typing throttles, kept in the cache only.
+
+Each user has one counter of open chat sockets, changed with the cache's atomic
+incr / decr so concurrent connects and disconnects never lose an update. The
+counter expires CHAT_PRESENCE_TTL seconds after the last connect or heartbeat,
+so sockets of a crashed worker age out on their own. Presence is only shared
+between workers when the cache is (Redis when REDIS_CACHE_URL is set); the local-memory
+cache keeps it per process.
+
+Typing frames are throttled per sender and thread: a change of state always goes
+out, a repeat of the current state at most once per CHAT_TYPING_THROTTLE_SECONDS.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+def _key(user_id):
+    return f'presence:user:{user_id}'
+
+
+def connected(user_id):
+    """
+    Registers a socket. Returns True when the user just came online.
+    """
+    key = _key(user_id)
+    cache.add(key, 0, _ttl())
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr().
+        cache.add(key, 1, _ttl())
+        count = 1
+    cache.touch(key, _ttl())
+    return count == 1
+
+
+def heartbeat(user_id):
+    if not cache.touch(_key(user_id), _ttl()):
+        cache.add(_key(user_id), 1, _ttl())
+
+
+def disconnected(user_id):
+    """
+    Drops a socket. Returns True when it was the user's last one.
+    """
+    key = _key(user_id)
+    try:
+        count = cache.decr(key)
+    except ValueError:
+        return True
+    if count <= 0:
+        cache.delete(key)
+        return True
+    return False
+
+
+def online_ids(user_ids):
+    counts = cache.get_many([_key(user_id) for user_id in user_ids])
+    return sorted(user_id for user_id in user_ids if counts.get(_key(user_id), 0) > 0)
+
+
+def typing_delay(user_id, thread_id, typing=True):
+    """
+    Seconds to hold a typing frame back: 0 to relay it now (and remember it as sent),
+    otherwise how long until a repeat of the same state may go out.
+    """
+    key = f'typing:{thread_id}:{user_id}'
+    window = getattr(settings, 'CHAT_TYPING_THROTTLE_SECONDS', 2)
+    now = time.time()
+    last = cache.get(key)
+    if last is not None and last[0] == typing and now - last[1] < window:
+        return window - (now - last[1])
+    cache.set(key, (typing, now), window)
+    return 0
@@ -0,0 +1,273 @@
+"""
+Incrementally maintained dashboard rollups.
+
+Signal handlers turn each Appointment / User / UserLink change into a set of
++1 / -1 deltas on the rollup tables, and apply them once the surrounding
+transaction commits. Doctor-scope patient counts are the exception: they are
+recounted for the affected (doctor, join month) row instead. `rebuild()`
+recomputes everything from the raw tables (see the `rebuild_dashboard_rollups`
+management command).
+"""
+from collections import Counter
+from datetime import datetime, time
+
+from dateutil.relativedelta import relativedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone as dj_timezone
+
+from .models import (
+    Appointment,
+    UserLink,
+    AppointmentDailyStat,
+    PatientMonthlyStat,
+    UserLinkDailyStat,
+)
+
+User = get_user_model()
+
+
+def local_day(value):
+    return dj_timezone.localtime(value, dj_timezone.get_default_timezone()).date()
+
+
+def local_month(value):
+    return local_day(value).replace(day=1)
+
+
+# ------------------------------
+# State snapshots and keys
+# ------------------------------
+
+def appointment_state(appointment):
+    if appointment is None:
+        return None
+    return {
+        'patient_id': appointment.patient_id,
+        'doctor_id': appointment.doctor_id,
+        'day': local_day(appointment.scheduled_date),
+        'status': appointment.status,
+    }
+
+
+def user_state(user):
+    if user is None:
+        return None
+    return {'role': user.role, 'month': local_month(user.date_joined)}
+
+
+def link_state(link):
+    if link is None:
+        return None
+    return {
+        'from_user_id': link.from_user_id,
+        'to_user_id': link.to_user_id,
+        'day': local_day(link.created_at),
+        'status': link.status,
+    }
+
+
+def _appointment_keys(state):
+    if not state:
+        return []
+    keys = [
+        ('all', None, state['day'], state['status']),
+        ('patient', state['patient_id'], state['day'], state['status']),
+    ]
+    if state['doctor_id']:
+        keys.append(('doctor', state['doctor_id'], state['day'], state['status']))
+    return keys
+
+
+def _patient_keys(state, user_id):
+    if not state or state['role'] != 'patient':
+        return []
+    return [('all', None, state['month']), ('patient', user_id, state['month'])]
+
+
+def _link_keys(state):
+    if not state:
+        return []
+    keys = []
+    if state['from_user_id']:
+        keys.append((state['from_user_id'], 'sent', state['day'], state['status']))
+    if state['to_user_id']:
+        keys.append((state['to_user_id'], 'received', state['day'], state['status']))
+    return keys
+
+
+def _diff(old_keys, new_keys):
+    deltas = Counter(new_keys)
+    deltas.subtract(Counter(old_keys))
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+# ------------------------------
+# Applying deltas
+# ------------------------------
+
+def _bump(model, delta, **key):
+    updated = model.objects.filter(**key).update(count=F('count') + delta)
+    if updated or delta < 0:
+        # Nothing to decrement when the row is gone (e.g. cascaded with its scope user).
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=delta, **key)
+    except IntegrityError:
+        model.objects.filter(**key).update(count=F('count') + delta)
+
+
+def _apply(appointment_deltas=None, patient_deltas=None, link_deltas=None):
+    for (scope, scope_user_id, day, status), delta in (appointment_deltas or {}).items():
+        _bump(AppointmentDailyStat, delta, scope=scope, scope_user_id=scope_user_id, day=day, status=status)
+    for (scope, scope_user_id, month), delta in (patient_deltas or {}).items():
+        _bump(PatientMonthlyStat, delta, scope=scope, scope_user_id=scope_user_id, month=month)
+    for (user_id, direction, day, status), delta in (link_deltas or {}).items():
+        _bump(UserLinkDailyStat, delta, user_id=user_id, direction=direction, day=day, status=status)
+
+
+def _apply_on_commit(**deltas):
+    if any(deltas.values()):
+        transaction.on_commit(lambda: _apply(**deltas))
+
+
+# ------------------------------
+# Signal entry points
+# ------------------------------
+
+def _recount_doctor_scope(doctor_id, patient_id):
+    """
+    Once the transaction commits, recounts the doctor-scope row for the patient's join month
+    from the raw tables. A patient is in a doctor's scope while they have any appointment
+    with that doctor; a cascaded or bulk delete removes all of a pair's appointments before
+    the first post_delete handler runs, so the row is recounted, not bumped per appointment.
+    """
+    if not doctor_id or not patient_id:
+        return
+    date_joined = User.objects.filter(pk=patient_id).values_list('date_joined', flat=True).first()
+    if date_joined is None:
+        return
+    month = local_month(date_joined)
+    transaction.on_commit(lambda: _set_doctor_month(doctor_id, month))
+
+
+def _set_doctor_month(doctor_id, month):
+    tz = dj_timezone.get_default_timezone()
+    start = dj_timezone.make_aware(datetime.combine(month, time.min), tz)
+    end = dj_timezone.make_aware(datetime.combine(month + relativedelta(months=1), time.min), tz)
+    count = (
+        Appointment.objects.filter(doctor_id=doctor_id, patient__date_joined__gte=start,
+                                   patient__date_joined__lt=end)
+        .values('patient_id').distinct().count()
+    )
+    rows = PatientMonthlyStat.objects.filter(scope='doctor', scope_user_id=doctor_id, month=month)
+    if rows.update(count=count) or not count:
+        return
+    try:
+        with transaction.atomic():
+            PatientMonthlyStat.objects.create(scope='doctor', scope_user_id=doctor_id, month=month, count=count)
+    except IntegrityError:
+        rows.update(count=count)
+
+
+def appointment_changed(old_state, new_state):
+    old_pair = (old_state['doctor_id'], old_state['patient_id']) if old_state else (None, None)
+    new_pair = (new_state['doctor_id'], new_state['patient_id']) if new_state else (None, None)
+    if old_pair != new_pair:
+        _recount_doctor_scope(*old_pair)
+        _recount_doctor_scope(*new_pair)
+
+    _apply_on_commit(appointment_deltas=_diff(_appointment_keys(old_state), _appointment_keys(new_state)))
+
+
+def user_changed(user_id, old_state, new_state):
+    # Changing date_joined of a patient already in a doctor's scope is left to rebuild().
+    _apply_on_commit(patient_deltas=_diff(_patient_keys(old_state, user_id), _patient_keys(new_state, user_id)))
+
+
+def link_changed(old_state, new_state):
+    _apply_on_commit(link_deltas=_diff(_link_keys(old_state), _link_keys(new_state)))
+
+
+# ------------------------------
+# Full rebuild
+# ------------------------------
+
+def _rebuild_models(apps):
+    if apps is None:
+        return User, Appointment, UserLink, AppointmentDailyStat, PatientMonthlyStat, UserLinkDailyStat
+    return (apps.get_model(settings.AUTH_USER_MODEL),) + tuple(
+        apps.get_model('accounts', name) for name in
+        ('Appointment', 'UserLink', 'AppointmentDailyStat', 'PatientMonthlyStat', 'UserLinkDailyStat')
+    )
+
+
+@transaction.atomic
+def rebuild(apps=None):
+    """
+    Recomputes every rollup row from the raw tables. Returns the number of rows written per table.
+    Data migrations pass their `apps` so that historical models are used.
+    """
+    User, Appointment, UserLink, AppointmentDailyStat, PatientMonthlyStat, UserLinkDailyStat = _rebuild_models(apps)
+    tz = dj_timezone.get_default_timezone()
+
+    appointments = Appointment.objects.annotate(day=TruncDate('scheduled_date', tzinfo=tz)).order_by()
+    appointment_rows = [
+        AppointmentDailyStat(scope='all', day=row['day'], status=row['status'], count=row['n'])
+        for row in appointments.values('day', 'status').annotate(n=Count('id'))
+    ]
+    for scope, field in (('doctor', 'doctor_id'), ('patient', 'patient_id')):
+        appointment_rows += [
+            AppointmentDailyStat(
+                scope=scope, scope_user_id=row[field], day=row['day'], status=row['status'], count=row['n']
+            )
+            for row in appointments.exclude(**{field: None}).values(field, 'day', 'status').annotate(n=Count('id'))
+        ]
+
+    patients = User.objects.filter(role='patient').order_by()
+    patient_rows = [
+        PatientMonthlyStat(scope='all', month=local_month(row['month']), count=row['n'])
+        for row in patients.annotate(month=TruncMonth('date_joined', tzinfo=tz))
+                           .values('month').annotate(n=Count('id'))
+    ]
+    patient_rows += [
+        PatientMonthlyStat(scope='patient', scope_user_id=user_id, month=local_month(date_joined), count=1)
+        for user_id, date_joined in patients.values_list('id', 'date_joined')
+    ]
+    patient_rows += [
+        PatientMonthlyStat(scope='doctor', scope_user_id=row['doctor_id'], month=local_month(row['month']),
+                           count=row['n'])
+        for row in Appointment.objects.exclude(doctor=None).order_by()
+                                      .annotate(month=TruncMonth('patient__date_joined', tzinfo=tz))
+                                      .values('doctor_id', 'month')
+                                      .annotate(n=Count('patient_id', distinct=True))
+    ]
+
+    links = UserLink.objects.annotate(day=TruncDate('created_at', tzinfo=tz)).order_by()
+    link_rows = []
+    for direction, field in (('sent', 'from_user_id'), ('received', 'to_user_id')):
+        link_rows += [
+            UserLinkDailyStat(
+                user_id=row[field], direction=direction, day=row['day'], status=row['status'], count=row['n']
+            )
+            for row in links.exclude(**{field: None}).values(field, 'day', 'status').annotate(n=Count('id'))
+        ]
+
+    for model, rows in (
+        (AppointmentDailyStat, appointment_rows),
+        (PatientMonthlyStat, patient_rows),
+        (UserLinkDailyStat, link_rows),
+    ):
+        model.objects.all().delete()
+        model.objects.bulk_create(rows, batch_size=1000)
+
+    return {
+        'appointments': len(appointment_rows),
+        'patients': len(patient_rows),
+        'links': len(link_rows),
+    }
@@ -5,7 +5,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.db.models import Q
 
-from .models import UserLink, Thread, Message, Appointment,Article
+from .models import UserLink, Thread, Message, ThreadReadState, Appointment,Article
+from . import message_search, archive
 
 User = get_user_model()
 
@@ -205,12 +206,22 @@ class CommunityUserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'first_name', 'last_name', 'role', 'profile_picture', 'connection_status')
 
     def get_profile_picture(self, obj):
-        if obj.profile_picture:
-            request = self.context.get('request')
-            return request.build_absolute_uri(obj.profile_picture.url) if request else obj.profile_picture.url
-        return ''
+        if not obj.profile_picture:
+            return ''
+        url = obj.profile_picture.url
+        request = self.context.get('request')
+        if not request or not url.startswith('/'):
+            return url
+        # Resolve scheme and host once per response instead of once per user.
+        if '_absolute_base' not in self.context:
+            self.context['_absolute_base'] = request.build_absolute_uri('/').rstrip('/')
+        return self.context['_absolute_base'] + url
 
     def get_connection_status(self, obj):
+        statuses = self.context.get('connection_statuses')
+        if statuses is not None:
+            return statuses.get(obj.id, 'none')
+
         current_user = self.context.get('current_user')
         if not current_user:
             return 'none'
@@ -239,16 +250,44 @@ class UserMinimalSerializer(serializers.ModelSerializer):
         return ''
 
 
+MESSAGE_PAGE_SIZE = 50
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender_id = serializers.IntegerField(source="sender.id", read_only=True)
     sender_username = serializers.CharField(source="sender.username", read_only=True)
-    read_by = UserMinimalSerializer(many=True, read_only=True)
+    read_by = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
         fields = ('id', 'thread', 'sender_id', 'sender_username', 'text', 'created_at', 'read_by')
         read_only_fields = ('created_at', 'sender_id', 'sender_username', 'read_by')
 
+    def get_read_by(self, obj):
+        # Derived from the thread's read cursors, loaded once per thread and shared via the context.
+        read_states = self.context.setdefault('read_states', {})
+        if obj.thread_id not in read_states:
+            read_states[obj.thread_id] = list(
+                ThreadReadState.objects.filter(thread_id=obj.thread_id).select_related('user').order_by('user_id')
+            )
+        readers = [state.user for state in read_states[obj.thread_id] if state.last_read_message_id >= obj.id]
+        return UserMinimalSerializer(readers, many=True, context=self.context).data
+
+
+
+class MessageSearchResultSerializer(serializers.ModelSerializer):
+    sender_id = serializers.IntegerField(source="sender.id", read_only=True)
+    sender_username = serializers.CharField(source="sender.username", read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    highlight = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ('id', 'thread', 'sender_id', 'sender_username', 'text', 'created_at', 'rank', 'highlight')
+
+    def get_highlight(self, obj):
+        return message_search.highlight(obj.text, self.context.get('search_terms', []),
+                                        headline=getattr(obj, 'headline', None))
 
 
 class ThreadSerializer(serializers.ModelSerializer):
@@ -261,28 +300,39 @@ class ThreadSerializer(serializers.ModelSerializer):
         fields = ('id', 'participants', 'created_at', 'last_message', 'unread_count')
 
     def get_last_message(self, obj):
-        last_msg = obj.messages.order_by('-created_at').first()
+        last_messages = self.context.get('last_messages')
+        if last_messages is not None and hasattr(obj, 'last_message_id'):
+            last_msg = last_messages.get(obj.last_message_id)
+        else:
+            last_msg = obj.messages.order_by('-created_at').first()
         if last_msg:
             return MessageSerializer(last_msg, context=self.context).data
         return None
 
     def get_unread_count(self, obj):
-        user = self.context['request'].user
-        return obj.messages.exclude(read_by=user).count()
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
+        return obj.unread_for(self.context['request'].user)
 
 
 class ThreadDetailSerializer(serializers.ModelSerializer):
     participants = UserMinimalSerializer(many=True, read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
+    messages = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Thread
         fields = ('id', 'participants', 'created_at', 'messages', 'unread_count')
 
+    def get_messages(self, obj):
+        # Newest page only, oldest first; older pages come from /threads/<id>/messages/?before=<id>.
+        newest = archive.history_page(archive.message_sources(obj.id), MESSAGE_PAGE_SIZE)
+        return MessageSerializer(newest, many=True, context=self.context).data
+
     def get_unread_count(self, obj):
-        user = self.context['request'].user
-        return obj.messages.exclude(read_by=user).count()
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
+        return obj.unread_for(self.context['request'].user)
 class GetOrCreateThreadSerializer(serializers.ModelSerializer):
     participants = UserMinimalSerializer(many=True, read_only=True)
 
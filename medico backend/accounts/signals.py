@@ -1,12 +1,28 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Appointment
+from .models import Appointment, User, UserLink, Thread, Message
 from .serializers import AppointmentSerializer
 from .consumers import notify_appointment
+from . import rollups, dashboard_cache, changes
+
+
+@receiver(pre_save, sender=Appointment)
+def appointment_pre_save(sender, instance, **kwargs):
+    previous = Appointment.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._rollup_state = rollups.appointment_state(previous)
 
 
 @receiver(post_save, sender=Appointment)
 def appointment_created_or_updated(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rollup_state', None)
+    rollups.appointment_changed(previous, rollups.appointment_state(instance))
+    dashboard_cache.invalidate(
+        instance.patient_id,
+        instance.doctor_id,
+        *((previous['patient_id'], previous['doctor_id']) if previous else ()),
+        everyone=True,
+    )
+
     data = AppointmentSerializer(instance).data
     event_type = "appointment_created" if created else "appointment_updated"
 
@@ -19,6 +35,9 @@ def appointment_created_or_updated(sender, instance, created, **kwargs):
 
 @receiver(post_delete, sender=Appointment)
 def appointment_deleted(sender, instance, **kwargs):
+    rollups.appointment_changed(rollups.appointment_state(instance), None)
+    dashboard_cache.invalidate(instance.patient_id, instance.doctor_id, everyone=True)
+
     data = AppointmentSerializer(instance).data
 
     if instance.patient:
@@ -26,3 +45,89 @@ def appointment_deleted(sender, instance, **kwargs):
 
     if instance.doctor:
         notify_appointment(instance.doctor.id, "appointment_deleted", data, target="doctor")
+
+
+# -----------------------------
+# Dashboard rollups
+# -----------------------------
+@receiver(pre_save, sender=User)
+def user_pre_save(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login; skip the lookup when role/date_joined can't change.
+    if update_fields is not None and not {'role', 'date_joined'} & set(update_fields):
+        instance._rollup_state = rollups.user_state(instance)
+        return
+    previous = User.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._rollup_state = rollups.user_state(previous)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    rollups.user_changed(instance.pk, getattr(instance, '_rollup_state', None), rollups.user_state(instance))
+
+    # Role, join date and country feed the patient summaries of admins and of the patient's doctors.
+    if created or update_fields is None or {'role', 'date_joined', 'country'} & set(update_fields):
+        doctor_ids = [] if created else list(
+            Appointment.objects.filter(patient_id=instance.pk).values_list('doctor_id', flat=True).distinct()
+        )
+        dashboard_cache.invalidate(instance.pk, *doctor_ids, everyone=True)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    rollups.user_changed(instance.pk, rollups.user_state(instance), None)
+    dashboard_cache.invalidate(instance.pk, everyone=True)
+
+
+@receiver(pre_save, sender=UserLink)
+def userlink_pre_save(sender, instance, **kwargs):
+    previous = UserLink.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._rollup_state = rollups.link_state(previous)
+
+
+@receiver(post_save, sender=UserLink)
+def userlink_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_rollup_state', None)
+    rollups.link_changed(previous, rollups.link_state(instance))
+    affected = (
+        instance.from_user_id,
+        instance.to_user_id,
+        *((previous['from_user_id'], previous['to_user_id']) if previous else ()),
+    )
+    dashboard_cache.invalidate(*affected)
+    changes.record_link(instance)
+
+
+@receiver(post_delete, sender=UserLink)
+def userlink_deleted(sender, instance, origin=None, **kwargs):
+    rollups.link_changed(rollups.link_state(instance), None)
+    dashboard_cache.invalidate(instance.from_user_id, instance.to_user_id)
+    if _deleted_directly(origin, UserLink):
+        changes.record_link(instance, deleted=True)
+
+
+# -----------------------------
+# Sync change sequence
+# -----------------------------
+def _deleted_directly(origin, model):
+    # Rows removed by a cascade from their user/thread can't get change events pointing at it.
+    return getattr(origin, 'model', type(origin)) is model
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        changes.record_messages([instance])
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(origin, Message):
+        changes.record_messages([instance], kind='message_deleted')
+
+
+@receiver(m2m_changed, sender=Thread.participants.through)
+def thread_participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add':
+        return
+    for thread_id in (pk_set if reverse else [instance.pk]):
+        changes.record_thread(thread_id)
@@ -1,3 +1,1102 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import time
+import zlib
+from io import StringIO
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.admin import site
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import rollups, message_queue, message_search, presence, frames
+from .admin import AppointmentAdmin
+from .checks import check_shared_cache
+from .consumers import ChatConsumer
+from .serializers import MESSAGE_PAGE_SIZE
+from .models import (
+    User, Appointment, UserLink, Thread, Message, ArchivedMessage, ThreadReadState, ChangeEvent,
+    AppointmentDailyStat, PatientMonthlyStat, UserLinkDailyStat,
+)
+
+
+class PatientsSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+        self.admin = User.objects.create_user(username='boss', password='x', role='admin')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_patients()
+
+    def create_patients(self):
+        joined = [
+            datetime(2025, 5, 10), datetime(2025, 8, 2), datetime(2025, 10, 1),
+            datetime(2025, 10, 20), datetime(2024, 1, 5),
+        ]
+        for i, date_joined in enumerate(joined):
+            patient = User.objects.create_user(
+                username=f'patient{i}', password='x', role='patient',
+                date_joined=timezone.make_aware(date_joined),
+            )
+            # Two appointments each, so the doctor scope would double count on a plain join.
+            for _ in range(2):
+                Appointment.objects.create(
+                    patient=patient, doctor=self.doctor, scheduled_date=timezone.now()
+                )
+
+    def test_admin_summary(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/dashboard/patients-summary/', {'month': '2025-10'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "total_patients": 5,
+            "new_patients_this_month": 2,
+            "last_six_months_totals": [1, 0, 0, 1, 0, 2],
+        })
+
+    def test_doctor_summary_counts_each_patient_once(self):
+        self.client.force_authenticate(self.doctor)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/dashboard/patients-summary/', {'month': '2025-10'})
+
+        self.assertEqual(response.json()["total_patients"], 5)
+        self.assertEqual(response.json()["last_six_months_totals"], [1, 0, 0, 1, 0, 2])
+
+    def test_month_is_required(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/dashboard/patients-summary/')
+        self.assertEqual(response.status_code, 400)
+
+
+class DashboardRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def snapshot(self):
+        return {
+            model.__name__: sorted(
+                (tuple(row) for row in model.objects.exclude(count=0).values_list(*fields)),
+                key=str,
+            )
+            for model, fields in (
+                (AppointmentDailyStat, ('scope', 'scope_user_id', 'day', 'status', 'count')),
+                (PatientMonthlyStat, ('scope', 'scope_user_id', 'month', 'count')),
+                (UserLinkDailyStat, ('user_id', 'direction', 'day', 'status', 'count')),
+            )
+        }
+
+    def test_signals_match_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+            other_doctor = User.objects.create_user(username='doc2', password='x', role='prothesist')
+            patients = [
+                User.objects.create_user(username=f'p{i}', password='x', role='patient') for i in range(4)
+            ]
+            first = Appointment.objects.create(patient=patients[0], doctor=doctor, scheduled_date=timezone.now())
+            Appointment.objects.create(
+                patient=patients[0], doctor=doctor, scheduled_date=timezone.now() - timedelta(days=40)
+            )
+            moved = Appointment.objects.create(patient=patients[1], doctor=doctor, scheduled_date=timezone.now())
+            link = UserLink.objects.create(from_user=doctor, to_user=patients[2])
+            dropped = UserLink.objects.create(from_user=patients[1], to_user=doctor)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.status = 'accepted'
+            first.save()
+            moved.doctor = other_doctor
+            moved.save()
+            link.status = 'accepted'
+            link.save()
+            dropped.delete()
+            patients[2].role = 'kinetherapist'
+            patients[2].save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _, removed = [
+                Appointment.objects.create(patient=patients[3], doctor=doctor, scheduled_date=timezone.now())
+                for _ in range(2)
+            ]
+        with self.captureOnCommitCallbacks(execute=True):
+            # A queryset (or cascaded) delete removes all of the pair's rows before any post_delete runs.
+            Appointment.objects.filter(patient=patients[0], doctor=doctor).delete()
+            removed.delete()
+
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_admin_status_actions_keep_rollups_in_step(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            admin = User.objects.create_user(username='boss', password='x', role='admin')
+            patient = User.objects.create_user(username='p', password='x', role='patient')
+            for _ in range(2):
+                Appointment.objects.create(patient=patient, scheduled_date=timezone.now())
+
+        model_admin = AppointmentAdmin(Appointment, site)
+        request = RequestFactory().post('/')
+        request.user = admin
+        with mock.patch.object(model_admin, 'message_user'), self.captureOnCommitCallbacks(execute=True):
+            model_admin.approve_appointments(request, Appointment.objects.all())
+
+        statuses = dict(AppointmentDailyStat.objects.filter(scope='all').exclude(count=0)
+                        .values_list('status', 'count'))
+        self.assertEqual(statuses, {'approved': 2})
+
+    def test_migration_backfill_uses_historical_models(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = User.objects.create_user(username='p', password='x', role='patient')
+            Appointment.objects.create(patient=patient, scheduled_date=timezone.now())
+        expected = self.snapshot()
+        for model in (AppointmentDailyStat, PatientMonthlyStat, UserLinkDailyStat):
+            model.objects.all().delete()
+
+        state = MigrationLoader(connection).project_state(('accounts', '0023_backfill_dashboard_rollups'))
+        rollups.rebuild(state.apps)
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_appointments_summary_reads_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            admin = User.objects.create_user(username='boss', password='x', role='admin')
+            patient = User.objects.create_user(username='p', password='x', role='patient')
+            Appointment.objects.create(patient=patient, scheduled_date=timezone.now(), status='pending')
+
+        client = APIClient()
+        client.force_authenticate(admin)
+        with self.assertNumQueries(1):
+            response = client.get('/api/dashboard/appointments-summary/', {'period': 'week'})
+
+        self.assertEqual(len(response.json()), 7)
+        self.assertEqual(response.json()[-1]["total"], 1)
+        self.assertEqual(response.json()[-1]["pending"], 1)
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+            self.patient = User.objects.create_user(username='p', password='x', role='patient')
+            self.appointment = Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, scheduled_date=timezone.now()
+            )
+
+    def get_summary(self):
+        return self.client.get('/api/dashboard/appointments-summary/', {'period': 'week'}).json()
+
+    def test_second_request_is_served_from_cache(self):
+        self.client.force_authenticate(self.doctor)
+        self.get_summary()
+        with self.assertNumQueries(0):
+            self.get_summary()
+
+    def test_appointment_change_invalidates_affected_users(self):
+        self.client.force_authenticate(self.doctor)
+        self.assertEqual(self.get_summary()[-1]["pending"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.status = 'accepted'
+            self.appointment.save()
+
+        self.assertEqual(self.get_summary()[-1]["pending"], 0)
+        self.assertEqual(self.get_summary()[-1]["accepted"], 1)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['accounts.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class DashboardOverviewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create_user(username='boss', password='x', role='admin')
+            patient = User.objects.create_user(
+                username='p', password='x', role='patient', country='TN', city='Sfax'
+            )
+            Appointment.objects.create(patient=patient, scheduled_date=timezone.now() + timedelta(days=2))
+            Appointment.objects.create(
+                patient=patient, scheduled_date=timezone.now() - timedelta(days=2), status='rejected'
+            )
+
+    def test_overview_matches_individual_endpoints(self):
+        self.client.force_authenticate(self.admin)
+        month = timezone.localdate().strftime('%Y-%m')
+        overview = self.client.get('/api/dashboard/overview/', {'period': 'week'}).json()
+
+        for key, path, params in (
+            ('links', 'links-summary', {}),
+            ('patients', 'patients-summary', {'month': month}),
+            ('nationality_map', 'patient-nationality-map', {}),
+            ('appointments', 'appointments-summary', {'period': 'week'}),
+        ):
+            self.assertEqual(overview[key], self.client.get(f'/api/dashboard/{path}/', params).json())
+
+        summary = overview['summary']
+        self.assertEqual(summary['total_appointments'], 2)
+        self.assertEqual(summary['upcoming_appointments'], 1)
+        self.assertEqual(summary['appointments_by_status'], {'pending': 1, 'rejected': 1})
+        self.assertEqual(summary['patients_by_city'], {'Sfax': 1})
+        self.assertIsNotNone(summary['next_appointment'])
+
+
+class AppointmentsSummaryTests(TestCase):
+    # A Wednesday.
+    NOW = timezone.make_aware(datetime(2025, 10, 15, 12, 0))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='boss', password='x', role='admin')
+        self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+        other_doctor = User.objects.create_user(username='doc2', password='x', role='doctor')
+        patient = User.objects.create_user(username='p', password='x', role='patient')
+
+        for days_ago, appointment_status, doctor in (
+            (0, 'pending', self.doctor),
+            (0, 'pending', other_doctor),
+            (0, 'accepted', self.doctor),
+            (0, 'reschedule_pending', self.doctor),
+            (2, 'rejected', self.doctor),
+            (2, 'accepted', self.doctor),
+            (14, 'pending', self.doctor),
+            (400, 'pending', self.doctor),
+        ):
+            Appointment.objects.create(
+                patient=patient, doctor=doctor, status=appointment_status,
+                scheduled_date=self.NOW - timedelta(days=days_ago),
+            )
+        rollups.rebuild()
+
+    def get_summary(self, user, period):
+        self.client.force_authenticate(user)
+        with mock.patch('django.utils.timezone.now', return_value=self.NOW):
+            response = self.client.get('/api/dashboard/appointments-summary/', {'period': period})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_week_counts_each_status_per_day(self):
+        summary = self.get_summary(self.admin, 'week')
+
+        self.assertEqual([bucket['date'] for bucket in summary], ['Thu', 'Fri', 'Sat', 'Sun', 'Mon', 'Tue', 'Wed'])
+        self.assertEqual(set(summary[0]), {'date', 'total', 'pending', 'accepted', 'rejected', 'growth', 'deltaUp'})
+        self.assertEqual(summary[4], {
+            'date': 'Mon', 'total': 2, 'pending': 0, 'accepted': 1, 'rejected': 1, 'growth': 0, 'deltaUp': True,
+        })
+        # reschedule_pending only counts towards the total.
+        self.assertEqual(summary[6], {
+            'date': 'Wed', 'total': 4, 'pending': 2, 'accepted': 1, 'rejected': 0, 'growth': 0, 'deltaUp': True,
+        })
+        self.assertEqual(sum(bucket['total'] for bucket in summary), 6)
+
+    def test_doctor_sees_only_own_appointments(self):
+        summary = self.get_summary(self.doctor, 'week')
+        self.assertEqual(summary[6]['total'], 3)
+        self.assertEqual(summary[6]['pending'], 1)
+        self.assertEqual(summary[6]['growth'], 0)
+
+    def test_month_and_year_buckets(self):
+        month = self.get_summary(self.admin, 'month')
+        self.assertEqual([bucket['date'] for bucket in month], ['Week 38', 'Week 39', 'Week 40', 'Week 41'])
+        self.assertEqual([bucket['total'] for bucket in month], [0, 1, 0, 6])
+        self.assertEqual([bucket['growth'] for bucket in month], [0, 0, -100.0, 0])
+        self.assertEqual([bucket['deltaUp'] for bucket in month], [True, True, False, True])
+
+        year = self.get_summary(self.admin, 'year')
+        self.assertEqual(len(year), 12)
+        self.assertEqual((year[0]['date'], year[-1]['date']), ('Nov', 'Oct'))
+        self.assertEqual(year[-1]['total'], 7)
+        self.assertEqual(sum(bucket['total'] for bucket in year), 7)
+
+
+class PatientNationalityMapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='boss', password='x', role='admin')
+        self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+        for i, country in enumerate(('TN', 'TN', 'FR', None)):
+            patient = User.objects.create_user(username=f'p{i}', password='x', role='patient', country=country)
+            # Two appointments with the same doctor must not count the patient twice.
+            if country == 'TN':
+                for _ in range(2):
+                    Appointment.objects.create(patient=patient, doctor=self.doctor, scheduled_date=timezone.now())
+        User.objects.create_user(username='pro', password='x', role='prothesist', country='FR')
+
+    def get_map(self, user):
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/dashboard/patient-nationality-map/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_admin_map_groups_patients_by_country_name(self):
+        self.assertEqual(self.get_map(self.admin), {'Tunisia': 2, 'France': 1, 'Unknown': 1})
+
+    def test_doctor_map_counts_own_patients_once(self):
+        self.assertEqual(self.get_map(self.doctor), {'Tunisia': 2})
+
+
+class LinksSummaryTests(TestCase):
+    NOW = timezone.make_aware(datetime(2025, 10, 15, 12, 0))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='doctor')
+        others = [User.objects.create_user(username=f'u{i}', password='x') for i in range(4)]
+        for from_user, to_user, link_status, created_at in (
+            (self.me, others[0], 'pending', datetime(2025, 10, 14)),
+            # Same month, previous year: not new this month.
+            (self.me, others[1], 'accepted', datetime(2024, 10, 5)),
+            (others[2], self.me, 'pending', datetime(2025, 10, 1)),
+            (others[3], self.me, 'accepted', datetime(2025, 9, 30)),
+            (others[0], others[1], 'accepted', datetime(2025, 10, 2)),
+        ):
+            link = UserLink.objects.create(from_user=from_user, to_user=to_user, status=link_status)
+            UserLink.objects.filter(pk=link.pk).update(created_at=timezone.make_aware(created_at))
+        rollups.rebuild()
+
+    def get_summary(self):
+        self.client.force_authenticate(self.me)
+        with mock.patch('django.utils.timezone.now', return_value=self.NOW):
+            response = self.client.get('/api/dashboard/links-summary/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_sent_and_received_links(self):
+        self.assertEqual(self.get_summary(), {
+            'total_links_sent': 2,
+            'total_links_received': 2,
+            'pending_sent': 1,
+            'accepted_sent': 1,
+            'pending_received': 1,
+            'accepted_received': 1,
+            'new_this_month_sent': 1,
+            'new_this_month_received': 1,
+        })
+
+    def test_new_this_month_ignores_same_month_of_earlier_years(self):
+        link = UserLink.objects.get(from_user=self.me, to_user__username='u0')
+        UserLink.objects.filter(pk=link.pk).update(created_at=timezone.make_aware(datetime(2023, 10, 20)))
+        rollups.rebuild()
+
+        summary = self.get_summary()
+        self.assertEqual(summary['total_links_sent'], 2)
+        self.assertEqual(summary['new_this_month_sent'], 0)
+
+
+class CommunityTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='doctor')
+        self.client.force_authenticate(self.me)
+
+    def add_users(self, count):
+        start = User.objects.count()
+        users = [
+            User.objects.create_user(username=f'user{start + i}', password='x', role='patient')
+            for i in range(count)
+        ]
+        UserLink.objects.create(from_user=self.me, to_user=users[0], status='accepted')
+        UserLink.objects.create(from_user=users[-1], to_user=self.me)
+        return users
+
+    def test_query_count_does_not_grow_with_users(self):
+        self.add_users(2)
+        with self.assertNumQueries(2):
+            self.client.get('/api/user-links/community/')
+
+        self.add_users(10)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/user-links/community/')
+
+        statuses = [user['connection_status'] for user in response.json()['results']]
+        self.assertEqual(len(statuses), 12)
+        self.assertEqual(statuses.count('accepted'), 2)
+        self.assertEqual(statuses.count('pending'), 2)
+        self.assertEqual(statuses.count('none'), 8)
+
+    def test_filters_search_and_pagination(self):
+        users = self.add_users(5)
+        users[1].first_name = 'Amira'
+        users[1].country = 'TN'
+        users[1].save()
+
+        page = self.client.get('/api/user-links/community/', {'page_size': 2}).json()
+        self.assertEqual(len(page['results']), 2)
+        next_page = self.client.get(page['next']).json()
+        self.assertEqual(len(next_page['results']), 2)
+        self.assertGreater(next_page['results'][0]['id'], page['results'][-1]['id'])
+
+        def ids(**params):
+            return [user['id'] for user in self.client.get('/api/user-links/community/', params).json()['results']]
+
+        self.assertEqual(ids(search='ami'), [users[1].id])
+        self.assertEqual(ids(country='tn'), [users[1].id])
+        self.assertEqual(ids(connection_status='accepted'), [users[0].id])
+        self.assertEqual(ids(connection_status='pending'), [users[-1].id])
+        self.assertEqual(len(ids(connection_status='none')), 3)
+        self.assertEqual(len(ids(role='patient')), 5)
+
+
+class NotificationsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='doctor')
+        self.client.force_authenticate(self.me)
+
+    def test_single_query_feed_ordered_by_event(self):
+        others = [User.objects.create_user(username=f'u{i}', password='x') for i in range(4)]
+        UserLink.objects.create(from_user=others[0], to_user=self.me)
+        accepted = UserLink.objects.create(from_user=self.me, to_user=others[1], status='accepted')
+        UserLink.objects.create(from_user=others[2], to_user=self.me)
+        UserLink.objects.create(from_user=self.me, to_user=others[3])  # own pending request: not a notification
+        UserLink.objects.filter(pk=accepted.pk).update(updated_at=timezone.now() + timedelta(minutes=5))
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user-links/notifications/')
+
+        results = response.json()['results']
+        self.assertEqual([n['type'] for n in results], ['accepted', 'request', 'request'])
+        self.assertEqual(results[0]['from_user']['username'], 'u1')
+        self.assertEqual([n['from_user']['username'] for n in results[1:]], ['u2', 'u0'])
+
+
+class UserLinkIndexTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='doctor')
+        self.client.force_authenticate(self.me)
+        for i in range(5):
+            other = User.objects.create_user(username=f'u{i}', password='x')
+            UserLink.objects.create(from_user=other, to_user=self.me)
+            UserLink.objects.create(from_user=self.me, to_user=other, link_type='doctor_patient')
+
+    def test_my_links_does_not_query_per_row(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user-links/my_links/')
+        self.assertEqual(len(response.json()), 10)
+
+    def test_notification_filter_uses_composite_index(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = UserLink.objects.filter(to_user=self.me, status='pending').explain()
+        self.assertIn('userlink_to_status_idx', plan)
+
+
+class ChatAuthorizationTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+        self.patient = User.objects.create_user(username='p', password='x', role='patient')
+
+    def consumer(self):
+        consumer = ChatConsumer()
+        consumer.user, consumer.participant_ids = self.patient, {self.doctor.id, self.patient.id}
+        return consumer
+
+    def test_chat_requires_an_accepted_link_with_every_participant(self):
+        link = UserLink.objects.create(from_user=self.doctor, to_user=self.patient)
+        self.assertFalse(self.consumer().has_accepted_link())
+
+        UserLink.objects.filter(pk=link.pk).update(status='accepted')
+        with self.assertNumQueries(1):
+            self.assertTrue(self.consumer().has_accepted_link())
+
+        other = User.objects.create_user(username='o', password='x', role='prothesist')
+        consumer = self.consumer()
+        consumer.participant_ids.add(other.id)
+        self.assertFalse(consumer.has_accepted_link())
+
+
+class ThreadListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='doctor')
+        self.client.force_authenticate(self.me)
+
+    def add_threads(self, count):
+        threads = []
+        for _ in range(count):
+            other = User.objects.create_user(username=f'u{User.objects.count()}', password='x')
+            thread = Thread.objects.create()
+            thread.participants.add(self.me, other)
+            for text in ('hello', 'again'):
+                message = Message.objects.create(thread=thread, sender=other, text=text)
+                message.mark_as_read(other)
+            threads.append(thread)
+        return threads
+
+    def test_inbox_query_count_is_constant(self):
+        self.add_threads(2)
+        with self.assertNumQueries(4):
+            self.client.get('/api/threads/')
+
+        threads = self.add_threads(5)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/threads/')
+
+        inbox = response.json()
+        self.assertEqual(len(inbox), 7)
+        self.assertEqual(inbox[0]['id'], threads[-1].id)
+        self.assertEqual(inbox[0]['last_message']['text'], 'again')
+        self.assertEqual(inbox[0]['unread_count'], 2)
+
+    def test_mark_read_moves_cursor_in_constant_queries(self):
+        thread = self.add_threads(1)[0]
+        other = thread.participants.exclude(pk=self.me.pk).get()
+        self.client.post(f'/api/threads/{thread.id}/mark_read/')
+        for i in range(20):
+            Message.objects.create(thread=thread, sender=other, text=f'm{i}')
+        self.assertEqual(self.client.get('/api/threads/').json()[0]['unread_count'], 20)
+
+        # thread lookup, participants prefetch, newest id, one UPDATE of the cursor, its sync event
+        with self.assertNumQueries(5):
+            self.client.post(f'/api/threads/{thread.id}/mark_read/')
+
+        inbox = self.client.get('/api/threads/').json()
+        self.assertEqual(inbox[0]['unread_count'], 0)
+        self.assertEqual([user['id'] for user in inbox[0]['last_message']['read_by']], [self.me.id])
+
+        reply = self.client.post('/api/messages/', {'thread': thread.id, 'text': 'hi'}, format='json').json()
+        self.assertEqual([user['id'] for user in reply['read_by']], [self.me.id])
+        self.assertEqual(ThreadReadState.objects.get(thread=thread, user=self.me).last_read_message_id, reply['id'])
+
+    def test_sending_leaves_earlier_incoming_messages_unread(self):
+        thread = self.add_threads(1)[0]
+
+        reply = self.client.post('/api/messages/', {'thread': thread.id, 'text': 'hi'}, format='json').json()
+        self.assertEqual(reply['read_by'], [])
+        self.assertFalse(ThreadReadState.objects.filter(thread=thread, user=self.me).exists())
+        self.assertEqual(self.client.get('/api/threads/').json()[0]['unread_count'], 2)
+
+        self.client.post(f'/api/threads/{thread.id}/mark_read/')
+        reply = self.client.post('/api/messages/', {'thread': thread.id, 'text': 'again'}, format='json').json()
+        self.assertEqual(ThreadReadState.objects.get(thread=thread, user=self.me).last_read_message_id, reply['id'])
+
+    def test_mark_read_broadcasts_one_coalesced_receipt(self):
+        thread = self.add_threads(1)[0]
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'chat_{thread.id}', channel)
+
+        self.client.post(f'/api/threads/{thread.id}/mark_read/')
+        self.client.post(f'/api/threads/{thread.id}/mark_read/')
+
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event, {
+            'type': 'read_receipt',
+            'user_id': self.me.id,
+            'up_to': thread.messages.order_by('-id').first().id,
+        })
+        # Nothing moved the second time, so the next event is our own marker.
+        async_to_sync(layer.send)(channel, {'type': 'marker'})
+        self.assertEqual(async_to_sync(layer.receive)(channel)['type'], 'marker')
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='patient')
+        self.other = User.objects.create_user(username='pro', password='x', role='prothesist')
+        self.thread = Thread.objects.create()
+        self.thread.participants.add(self.me, self.other)
+        self.messages = [
+            Message.objects.create(thread=self.thread, sender=self.other, text=f'm{i}') for i in range(7)
+        ]
+        # Same timestamp for everything: the id breaks the tie.
+        Message.objects.filter(thread=self.thread).update(created_at=timezone.now())
+        self.client.force_authenticate(self.me)
+
+    def ids(self, response):
+        return [message['id'] for message in response.json()['results']]
+
+    def test_pages_walk_backwards_and_forwards(self):
+        ids = [message.id for message in self.messages]
+        url = f'/api/threads/{self.thread.id}/messages/'
+
+        newest = self.client.get(url, {'page_size': 3})
+        self.assertEqual(self.ids(newest), ids[4:])
+        self.assertIsNone(newest.json()['next'])
+
+        older = self.client.get(newest.json()['previous'])
+        self.assertEqual(self.ids(older), ids[1:4])
+        oldest = self.client.get(older.json()['previous'])
+        self.assertEqual(self.ids(oldest), ids[:1])
+        self.assertIsNone(oldest.json()['previous'])
+
+        newer = self.client.get(oldest.json()['next'])
+        self.assertEqual(self.ids(newer), ids[1:4])
+
+    def test_thread_detail_returns_newest_page_only(self):
+        for i in range(MESSAGE_PAGE_SIZE):
+            Message.objects.create(thread=self.thread, sender=self.me, text=f'n{i}')
+        data = self.client.get(f'/api/threads-with-messages/{self.thread.id}/').json()
+        self.assertEqual(len(data['messages']), MESSAGE_PAGE_SIZE)
+        self.assertEqual(data['messages'][-1]['text'], f'n{MESSAGE_PAGE_SIZE - 1}')
+
+    def test_history_is_limited_to_participants(self):
+        self.client.force_authenticate(User.objects.create_user(username='x', password='x'))
+        self.assertEqual(self.client.get(f'/api/threads/{self.thread.id}/messages/').status_code, 404)
+        self.client.force_authenticate(self.me)
+        self.assertEqual(self.client.get(f'/api/threads/{self.thread.id}/messages/?before=abc').status_code, 404)
+
+
+class ChatReplayTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user(username='me', password='x', role='patient')
+        self.other = User.objects.create_user(username='doc', password='x', role='doctor')
+        self.thread = Thread.objects.create()
+        self.thread.participants.add(self.me, self.other)
+
+    def consumer(self):
+        consumer = ChatConsumer()
+        consumer.user, consumer.thread = self.me, self.thread
+        return consumer
+
+    @override_settings(CHAT_REPLAY_LIMIT=5)
+    def test_replay_is_one_batch_capped_at_the_window(self):
+        first = Message.objects.create(thread=self.thread, sender=self.other, text='old')
+        first.mark_as_read(self.me)
+        sent = [Message.objects.create(thread=self.thread, sender=self.other, text=f'm{i}') for i in range(8)]
+        sent[-1].mark_as_read(self.other)
+
+        with self.assertNumQueries(2):
+            messages, has_more = self.consumer().get_unread_messages()
+
+        self.assertTrue(has_more)
+        self.assertEqual([message['id'] for message in messages], [message.id for message in sent[3:]])
+        self.assertEqual(messages[-1]['sender_username'], 'doc')
+        self.assertEqual(messages[-1]['read_by'], [self.other.id])
+        self.assertEqual(messages[0]['read_by'], [self.other.id])
+
+    def test_read_frames_clamp_to_existing_messages_and_never_rewind(self):
+        sent = [Message.objects.create(thread=self.thread, sender=self.other, text=f'm{i}') for i in range(3)]
+        consumer = self.consumer()
+        consumer.thread_id = self.thread.id
+
+        self.assertEqual(consumer.save_read(sent[-1].id + 100), sent[-1].id)
+        self.assertIsNone(consumer.save_read(sent[0].id))
+        self.assertEqual(ThreadReadState.objects.get(thread=self.thread, user=self.me).last_read_message_id,
+                         sent[-1].id)
+
+    def socket(self):
+        consumer = self.consumer()
+        consumer.thread_id, consumer.room_group_name = self.thread.id, f'chat_{self.thread.id}'
+        consumer.channel_name = 'test-channel'
+        consumer.channel_layer = mock.Mock(group_send=mock.AsyncMock(), group_discard=mock.AsyncMock())
+        consumer.save_read = mock.Mock(wraps=consumer.save_read)
+        return consumer
+
+    def receipts(self, consumer):
+        return [call.args[1] for call in consumer.channel_layer.group_send.await_args_list
+                if call.args[1]['type'] == 'read_receipt']
+
+    @override_settings(CHAT_READ_COALESCE_MS=20)
+    def test_a_burst_of_read_frames_is_one_write_and_one_receipt(self):
+        sent = [Message.objects.create(thread=self.thread, sender=self.other, text=f'm{i}') for i in range(5)]
+        consumer = self.socket()
+
+        async def read_burst():
+            for message in sent:
+                await consumer.receive(text_data=json.dumps({'type': 'read', 'up_to': message.id}))
+            await asyncio.sleep(0.06)
+
+        async_to_sync(read_burst)()
+        consumer.save_read.assert_called_once_with(sent[-1].id)
+        self.assertEqual(self.receipts(consumer), [{'type': 'read_receipt', 'user_id': self.me.id,
+                                                    'up_to': sent[-1].id}])
+        self.assertEqual(ThreadReadState.objects.get(thread=self.thread, user=self.me).last_read_message_id,
+                         sent[-1].id)
+
+    @override_settings(CHAT_READ_COALESCE_MS=60_000)
+    def test_disconnect_flushes_the_pending_read(self):
+        sent = [Message.objects.create(thread=self.thread, sender=self.other, text=f'm{i}') for i in range(3)]
+        consumer = self.socket()
+
+        async def read_then_leave():
+            for message in sent[:2]:
+                await consumer.receive(text_data=json.dumps({'type': 'read', 'up_to': message.id}))
+            await consumer.disconnect(1000)
+
+        async_to_sync(read_then_leave)()
+        consumer.save_read.assert_called_once_with(sent[1].id)
+        self.assertIsNone(consumer.read_flush_task)
+        self.assertEqual([receipt['up_to'] for receipt in self.receipts(consumer)], [sent[1].id])
+        self.assertEqual(ThreadReadState.objects.get(thread=self.thread, user=self.me).last_read_message_id,
+                         sent[1].id)
+
+
+class ChatWriteBehindTests(TestCase):
+    def setUp(self):
+        # Ids come from the PostgreSQL sequence in production.
+        ids = itertools.count(1000)
+        patcher = mock.patch.object(message_queue, 'reserve_id', side_effect=lambda: next(ids))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.me = User.objects.create_user(username='me', password='x', role='patient')
+        self.thread = Thread.objects.create()
+        self.thread.participants.add(self.me)
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    def test_only_enabled_on_postgresql(self):
+        self.assertEqual(message_queue.enabled(), connection.vendor == 'postgresql')
+
+    def test_messages_are_stored_in_batches_with_their_broadcast_ids(self):
+        queue = message_queue.WriteBehindQueue(batch_size=3, interval_ms=60_000)
+        messages = [message_queue.build_message(self.thread, self.me, f'm{i}') for i in range(4)]
+
+        async def send(batch):
+            for message in batch:
+                await queue.put(message)
+
+        async_to_sync(send)(messages[:2])
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(queue.stats()['depth'], 2)
+
+        async_to_sync(send)(messages[2:])
+        stored = list(Message.objects.order_by('id').values_list('id', 'text', 'created_at'))
+        self.assertEqual(stored, [(m.id, m.text, m.created_at) for m in messages[:3]])
+        self.assertEqual(ThreadReadState.objects.get(thread=self.thread, user=self.me).last_read_message_id,
+                         messages[2].id)
+
+        async_to_sync(queue.flush)()
+        self.assertEqual(Message.objects.count(), 4)
+        self.assertEqual(queue.stats()['depth'], 0)
+        self.assertEqual(queue.stats()['flushes'], 2)
+
+    def test_a_bad_message_does_not_block_the_queue(self):
+        queue = message_queue.WriteBehindQueue(batch_size=10, interval_ms=60_000, max_attempts=2)
+        taken = Message.objects.create(thread=self.thread, sender=self.me, text='stored')
+        good = message_queue.build_message(self.thread, self.me, 'good')
+        clash = message_queue.build_message(self.thread, self.me, 'clash')
+        clash.id = taken.id
+        later = message_queue.build_message(self.thread, self.me, 'later')
+
+        async def send(batch):
+            for message in batch:
+                await queue.put(message)
+            await queue.flush()
+
+        with self.assertLogs('accounts.message_queue', 'ERROR'):
+            async_to_sync(send)([good, clash])
+        self.assertTrue(Message.objects.filter(pk=good.id).exists())
+        self.assertEqual(queue.stats()['depth'], 1)
+
+        with self.assertLogs('accounts.message_queue.dead_letter', 'ERROR') as logs:
+            async_to_sync(send)([later])
+        self.assertTrue(Message.objects.filter(pk=later.id).exists())
+        self.assertIn('"text": "clash"', logs.output[-1])
+        self.assertEqual(queue.stats()['depth'], 0)
+        self.assertEqual(queue.stats()['dead_letters'], 1)
+
+
+class DirectThreadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+        self.patient = User.objects.create_user(username='p', password='x', role='patient')
+
+    def test_both_sides_get_the_same_canonical_thread(self):
+        url = '/api/threads-with-messages/get_or_create_with_user/'
+        self.client.force_authenticate(self.patient)
+        first = self.client.post(url, {'user_id': self.doctor.id}, format='json').json()
+        self.client.force_authenticate(self.doctor)
+        second = self.client.get(url, {'user_id': self.patient.id}).json()
+
+        self.assertEqual(first['id'], second['id'])
+        thread = Thread.objects.get()
+        low, high = sorted((self.doctor.id, self.patient.id))
+        self.assertEqual((thread.min_user_id, thread.max_user_id), (low, high))
+        self.assertEqual(set(thread.participants.values_list('id', flat=True)), {low, high})
+
+    def test_creating_a_two_person_thread_reuses_the_direct_thread(self):
+        self.client.force_authenticate(self.patient)
+        first = self.client.post('/api/threads/', {'participants': [self.doctor.id]}, format='json')
+        self.client.force_authenticate(self.doctor)
+        second = self.client.post('/api/threads/', {'user_id': self.patient.id}, format='json')
+        via_lookup = self.client.get('/api/threads-with-messages/get_or_create_with_user/',
+                                     {'user_id': self.patient.id}).json()
+
+        self.assertEqual((first.status_code, second.status_code), (201, 200))
+        self.assertEqual({first.json()['id'], second.json()['id'], via_lookup['id']}, {first.json()['id']})
+        self.assertEqual(Thread.objects.count(), 1)
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = User.objects.create_user(username='p', password='x', role='patient')
+        self.pro = User.objects.create_user(username='pro', password='x', role='prothesist')
+        self.thread, _ = Thread.get_or_create_direct(self.patient, self.pro)
+        self.client.force_authenticate(self.patient)
+
+    def search(self, **params):
+        return self.client.get('/api/messages/search/', params)
+
+    def test_matches_all_terms_in_own_threads_and_highlights(self):
+        hit = Message.objects.create(thread=self.thread, sender=self.pro, text='Clean the <socket> liner daily')
+        Message.objects.create(thread=self.thread, sender=self.pro, text='Socket fits well')
+        stranger, _ = Thread.get_or_create_direct(self.pro, User.objects.create_user(username='o', password='x'))
+        Message.objects.create(thread=stranger, sender=self.pro, text='socket liner for someone else')
+
+        results = self.search(q='liner SOCKET').json()['results']
+        self.assertEqual([result['id'] for result in results], [hit.id])
+        self.assertEqual(results[0]['highlight'], 'Clean the &lt;<mark>socket</mark>&gt; <mark>liner</mark> daily')
+        self.assertEqual(self.search(q='  ').status_code, 400)
+
+    def test_matches_and_highlights_whole_words_only(self):
+        hit = Message.objects.create(thread=self.thread, sender=self.pro, text='Art class, then heart checkup')
+        Message.objects.create(thread=self.thread, sender=self.pro, text='My heart rate is fine')
+
+        results = self.search(q='art').json()['results']
+        self.assertEqual([result['id'] for result in results], [hit.id])
+        self.assertEqual(results[0]['highlight'], '<mark>Art</mark> class, then heart checkup')
+
+    def test_headline_markers_become_marks_after_escaping(self):
+        headline = f'a <b> {message_search.START_SEL}heart{message_search.STOP_SEL} & more'
+        self.assertEqual(message_search.highlight('ignored', ['heart'], headline=headline),
+                         'a &lt;b&gt; <mark>heart</mark> &amp; more')
+
+    def test_results_are_keyset_paginated(self):
+        sent = [Message.objects.create(thread=self.thread, sender=self.pro, text=f'exercise {i}') for i in range(5)]
+        first = self.search(q='exercise', page_size=2).json()
+        second = self.client.get(first['next']).json()
+        third = self.client.get(second['next']).json()
+        ids = [r['id'] for page in (first, second, third) for r in page['results']]
+        self.assertEqual(sorted(ids), sorted(message.id for message in sent))
+        self.assertEqual(len(set(ids)), 5)
+        self.assertIsNone(third['next'])
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_presence_follows_sockets_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(presence.connected(1))
+            self.assertFalse(presence.connected(1))
+            presence.heartbeat(1)
+            self.assertEqual(presence.online_ids([1, 2]), [1])
+            self.assertFalse(presence.disconnected(1))
+            self.assertTrue(presence.disconnected(1))
+            self.assertEqual(presence.online_ids([1, 2]), [])
+
+    @override_settings(CHAT_PRESENCE_TTL=30)
+    def test_silent_sockets_expire(self):
+        presence.connected(1)
+        with mock.patch('time.time', return_value=time.time() + 31):
+            self.assertEqual(presence.online_ids([1]), [])
+            self.assertTrue(presence.connected(1))
+
+    def test_typing_throttles_repeats_but_not_changes(self):
+        self.assertEqual(presence.typing_delay(1, 10), 0)
+        self.assertGreater(presence.typing_delay(1, 10), 0)
+        self.assertEqual(presence.typing_delay(1, 10, typing=False), 0)
+        self.assertEqual(presence.typing_delay(1, 10, typing=True), 0)
+        self.assertEqual(presence.typing_delay(2, 10), 0)
+        with mock.patch('time.time', return_value=time.time() + 3):
+            self.assertEqual(presence.typing_delay(1, 10), 0)
+
+    @override_settings(CHAT_TYPING_THROTTLE_SECONDS=0.05)
+    def test_held_typing_repeats_end_with_one_trailing_frame(self):
+        consumer = ChatConsumer()
+        consumer.user = User.objects.create_user(username='me', password='x')
+        consumer.thread_id, consumer.room_group_name = 10, 'chat_10'
+        consumer.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+
+        async def type_then_wait():
+            for typing in (True, True, True, False, True, True):
+                await consumer.relay_typing(typing)
+            await asyncio.sleep(0.1)
+
+        async_to_sync(type_then_wait)()
+        sent = [call.args[1]['typing'] for call in consumer.channel_layer.group_send.await_args_list]
+        self.assertEqual(sent, [True, False, True, True])
+
+
+@skipUnless(frames.msgpack, 'msgpack is not installed')
+class FrameEncodingTests(TestCase):
+    def test_negotiation(self):
+        codec, subprotocol = frames.negotiate({'query_string': b'token=x'})
+        self.assertFalse(codec.binary)
+        codec, subprotocol = frames.negotiate({'query_string': b'encoding=msgpack&compress=deflate'})
+        self.assertEqual((codec.binary, codec.deflate, subprotocol), (True, True, None))
+        codec, subprotocol = frames.negotiate({'query_string': b'', 'subprotocols': ['v1', 'msgpack']})
+        self.assertEqual((codec.binary, codec.deflate, subprotocol), (True, False, 'msgpack'))
+
+    def test_history_frames_are_short_coded_and_deflated(self):
+        history = {
+            'type': 'history',
+            'has_more': False,
+            'messages': [
+                {'id': i, 'thread': 1, 'sender_id': 2, 'sender_username': 'doc', 'message': 'Keep the liner dry',
+                 'created_at': '2026-10-18T10:00:00+00:00', 'read_by': [2], 'tempId': None}
+                for i in range(50)
+            ],
+        }
+        json_size = len(frames.FrameCodec().encode(history)['text_data'])
+        packed = frames.FrameCodec(binary=True).encode(history)['bytes_data']
+        deflated = frames.FrameCodec(binary=True, deflate=True).encode(history, compressible=True)['bytes_data']
+
+        self.assertEqual(packed[0], frames.PLAIN)
+        self.assertEqual(deflated[0], frames.DEFLATED)
+        self.assertLess(len(deflated), len(packed))
+        self.assertLess(len(packed), json_size / 2)
+        self.assertIn(b'sender_username', frames.FrameCodec().encode(history)['text_data'].encode())
+        self.assertNotIn(b'sender_username', packed)
+        for data in (packed, deflated):
+            self.assertEqual(frames.FrameCodec(binary=True).decode(bytes_data=data), history)
+
+    @override_settings(WS_MAX_INBOUND_FRAME_BYTES=4096)
+    def test_inbound_frames_are_capped_before_inflating(self):
+        codec = frames.FrameCodec(binary=True, deflate=True)
+        bomb = bytes([frames.DEFLATED]) + zlib.compress(b'\x00' * 3_000_000)
+        self.assertLess(len(bomb), 4096)
+        with self.assertRaises(frames.FrameTooLarge):
+            codec.decode(bytes_data=bomb)
+        with self.assertRaises(frames.FrameTooLarge):
+            codec.decode(text_data='"' + 'x' * 5000 + '"')
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = User.objects.create_user(username='p', password='x', role='patient')
+        self.doctor = User.objects.create_user(username='doc', password='x', role='doctor')
+        self.client.force_authenticate(self.patient)
+
+    def sync(self, since):
+        return self.client.get('/api/sync/', {'since': since}).json()
+
+    def test_returns_only_what_changed_after_the_cursor(self):
+        thread, _ = Thread.get_or_create_direct(self.patient, self.doctor)
+        Message.objects.create(thread=thread, sender=self.doctor, text='before')
+        cursor = self.client.get('/api/sync/').json()['cursor']
+
+        link = UserLink.objects.create(from_user=self.doctor, to_user=self.patient)
+        new = Message.objects.create(thread=thread, sender=self.doctor, text='after')
+        gone = Message.objects.create(thread=thread, sender=self.doctor, text='oops')
+        gone_id = gone.id
+        gone.delete()
+        self.client.post(f'/api/threads/{thread.id}/mark_read/')
+        other_thread, _ = Thread.get_or_create_direct(
+            self.doctor, User.objects.create_user(username='o', password='x')
+        )
+        Message.objects.create(thread=other_thread, sender=self.doctor, text='not mine')
+
+        data = self.sync(cursor)
+        self.assertEqual([message['text'] for message in data['messages']], ['after'])
+        self.assertEqual(data['deleted_messages'], [gone_id])
+        self.assertEqual(data['read_states'][0]['last_read_message_id'], new.id)
+        self.assertEqual([item['id'] for item in data['links']], [link.id])
+        self.assertEqual(data['threads'], [])
+        self.assertFalse(data['has_more'])
+
+        self.assertEqual(self.sync(data['cursor'])['messages'], [])
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_pages_through_backlog(self):
+        thread, _ = Thread.get_or_create_direct(self.patient, self.doctor)
+        for i in range(3):
+            Message.objects.create(thread=thread, sender=self.doctor, text=f'm{i}')
+
+        first = self.sync(0)
+        self.assertTrue(first['has_more'])
+        self.assertEqual([item['id'] for item in first['threads']], [thread.id])
+        second = self.sync(first['cursor'])
+        self.assertEqual([message['text'] for message in first['messages'] + second['messages']],
+                         ['m0', 'm1', 'm2'])
+        self.assertFalse(second['has_more'])
+
+    def test_initial_cursor_stays_before_unsettled_events(self):
+        thread, _ = Thread.get_or_create_direct(self.patient, self.doctor)
+        settled = Message.objects.create(thread=thread, sender=self.doctor, text='settled')
+        ChangeEvent.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+        Message.objects.create(thread=thread, sender=self.doctor, text='just now')
+
+        with override_settings(SYNC_SETTLE_SECONDS=30):
+            cursor = self.client.get('/api/sync/').json()['cursor']
+        self.assertEqual(cursor, ChangeEvent.objects.get(kind='message', object_id=settled.id).id)
+        self.assertEqual([message['text'] for message in self.sync(cursor)['messages']], ['just now'])
+
+    @override_settings(SYNC_RETENTION_DAYS=30)
+    def test_pruned_history_expires_older_cursors(self):
+        thread, _ = Thread.get_or_create_direct(self.patient, self.doctor)
+        Message.objects.create(thread=thread, sender=self.doctor, text='old')
+        ChangeEvent.objects.update(created_at=timezone.now() - timedelta(days=31))
+        cursor = ChangeEvent.objects.latest('id').id
+        Message.objects.create(thread=thread, sender=self.doctor, text='new')
+
+        out = StringIO()
+        call_command('archive_messages', stdout=out)
+        self.assertIn('Pruned 2 sync change events.', out.getvalue())
+        self.assertEqual(self.client.get('/api/sync/', {'since': 0}).status_code, 410)
+        self.assertEqual([message['text'] for message in self.sync(cursor)['messages']], ['new'])
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.me = User.objects.create_user(username='me', password='x', role='patient')
+        self.other = User.objects.create_user(username='pro', password='x', role='prothesist')
+        self.thread, _ = Thread.get_or_create_direct(self.me, self.other)
+        self.messages = [
+            Message.objects.create(thread=self.thread, sender=self.other, text=f'm{i} é') for i in range(6)
+        ]
+        old = timezone.now() - timedelta(days=400)
+        for i, message in enumerate(self.messages[:4]):
+            Message.objects.filter(pk=message.pk).update(created_at=old + timedelta(minutes=i))
+        self.client.force_authenticate(self.me)
+        self.cursor = self.client.get('/api/sync/').json()['cursor']
+
+    def archive(self, **options):
+        call_command('archive_messages', days=365, stdout=StringIO(), **options)
+
+    def test_moves_old_messages_to_the_archive(self):
+        self.archive(batch_size=3)
+
+        ids = [message.id for message in self.messages]
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), ids[4:])
+        archived = list(ArchivedMessage.objects.order_by('id'))
+        self.assertEqual([message.id for message in archived], ids[:4])
+        self.assertEqual(archived[0].text, 'm0 é')
+        # Moving is not deleting: sync clients are told nothing.
+        self.assertEqual(self.client.get('/api/sync/', {'since': self.cursor}).json()['deleted_messages'], [])
+
+    def test_history_reads_through_into_the_archive(self):
+        self.archive()
+        ids = [message.id for message in self.messages]
+        url = f'/api/threads/{self.thread.id}/messages/'
+
+        newest = self.client.get(url, {'page_size': 3}).json()
+        self.assertEqual([message['id'] for message in newest['results']], ids[3:])
+        older = self.client.get(newest['previous']).json()
+        self.assertEqual([message['text'] for message in older['results']], ['m0 é', 'm1 é', 'm2 é'])
+        self.assertIsNone(older['previous'])
+        newer = self.client.get(url, {'after': ids[1], 'page_size': 3}).json()
+        self.assertEqual([message['id'] for message in newer['results']], ids[2:5])
+
+        detail = self.client.get(f'/api/threads-with-messages/{self.thread.id}/').json()
+        self.assertEqual([message['id'] for message in detail['messages']], ids)
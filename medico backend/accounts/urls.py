@@ -17,7 +17,8 @@ from .views import (
     reschedule_appointment,
     confirm_reschedule,
     check_prosthesis,
-    DashboardViewSet,ArticleViewSet  
+    DashboardViewSet,ArticleViewSet,
+    sync_changes,
 )
 
 router = DefaultRouter()
@@ -48,5 +49,8 @@ urlpatterns = [
 
     path('check-prosthesis/', check_prosthesis, name='check_prosthesis'),
 
+    # Chat delta sync
+    path('sync/', sync_changes, name='sync'),
+
     path('', include(router.urls)),
 ]
@@ -7,14 +7,15 @@ from django.utils import timezone as dj_timezone
 from ai_model.pose_model import predict_prosthesis
 from rest_framework.permissions import AllowAny
 import torch
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Sum, Min, Max
 from datetime import timedelta
 import logging
 import firebase_admin
 from firebase_admin import auth as firebase_auth
 import pycountry
 import cv2
-from base64 import b64encode
+from base64 import b64encode, b64decode
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.hashers import make_password
 
@@ -22,6 +23,9 @@ from django.contrib.auth import get_user_model
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.decorators import api_view, permission_classes, action,parser_classes, authentication_classes
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 import traceback
 from rest_framework.views import APIView
 
@@ -32,7 +36,8 @@ import os
 
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
-from django.db.models import Q
+from django.db.models import Q, F, Case, When, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 import requests
 
 from .serializers import (
@@ -43,20 +48,29 @@ from .serializers import (
     UserLinkSerializer,
     ThreadSerializer,
     MessageSerializer,
+    MessageSearchResultSerializer,
     CommunityUserSerializer,
     ThreadDetailSerializer,
+    GetOrCreateThreadSerializer,
     DashboardSummarySerializer,
     PatientSummarySerializer,
     PatientTrendSerializer,
     LinkSummarySerializer,
-    ArticleSerializer
+    ArticleSerializer,
+    MESSAGE_PAGE_SIZE,
 )
 from .utils import send_welcome_email,send_password_reset_email
 from .permissions import IsAdminRole
-from .models import Appointment, UserLink, Thread, Message,Article
+from . import dashboard_cache, message_queue, message_search, changes, archive
+from .consumers import notify_read_receipt
+from .models import Appointment, UserLink, Thread, Message, ArchivedMessage, ThreadReadState, ChangeEvent, Article
+from .models import AppointmentDailyStat, PatientMonthlyStat, UserLinkDailyStat
 from ai_model.pose_model import predict_prosthesis
 User = get_user_model()
 
+# Alpha-2 code -> display name, built once at import instead of per patient.
+COUNTRY_NAMES = {country.alpha_2: country.name for country in pycountry.countries}
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @authentication_classes([])
@@ -158,7 +172,9 @@ class DashboardViewSet(viewsets.GenericViewSet):
             patients = User.objects.filter(role="patient")
             appointments = Appointment.objects.all()
         elif user.role in ["doctor", "prothesist", "kinetherapist"]:
-            patients = User.objects.filter(appointments_as_patient__doctor=user).distinct()
+            patients = User.objects.filter(
+                id__in=Appointment.objects.filter(doctor=user).values('patient_id')
+            )
             appointments = Appointment.objects.filter(doctor=user)
         elif user.role == "patient":
             patients = User.objects.filter(id=user.id)
@@ -169,58 +185,65 @@ class DashboardViewSet(viewsets.GenericViewSet):
 
         return patients, appointments, now
 
-    @action(detail=False, methods=['get'], url_path='links-summary')
-    def links_summary(self, request):
-        user = request.user
-
-        sent_links = UserLink.objects.filter(from_user=user)
-        received_links = UserLink.objects.filter(to_user=user)
-
-        data = {
-            "total_links_sent": sent_links.count(),
-            "total_links_received": received_links.count(),
-            "pending_sent": sent_links.filter(status="pending").count(),
-            "accepted_sent": sent_links.filter(status="accepted").count(),
-            "pending_received": received_links.filter(status="pending").count(),
-            "accepted_received": received_links.filter(status="accepted").count(),
-            "new_this_month_sent": sent_links.filter(
-                created_at__month=dj_timezone.now().month
-            ).count(),
-            "new_this_month_received": received_links.filter(
-                created_at__month=dj_timezone.now().month
-            ).count()
-        }
+    def _get_rollup_scope(self, user):
+        """
+        Returns the rollup filter matching _get_user_scope for this user, or None
+        """
+        if user.role == "admin":
+            return Q(scope='all', scope_user__isnull=True)
+        if user.role in ["doctor", "prothesist", "kinetherapist"]:
+            return Q(scope='doctor', scope_user=user)
+        if user.role == "patient":
+            return Q(scope='patient', scope_user=user)
+        return None
+
+    def _links_summary_data(self, user, params):
+        month_start = dj_timezone.localdate().replace(day=1)
+        month_end = month_start + relativedelta(months=1)
+
+        sent = Q(direction='sent')
+        received = Q(direction='received')
+        this_month = Q(day__gte=month_start, day__lt=month_end)
+
+        counts = UserLinkDailyStat.objects.filter(user=user).aggregate(
+            total_links_sent=Sum('count', filter=sent),
+            total_links_received=Sum('count', filter=received),
+            pending_sent=Sum('count', filter=sent & Q(status="pending")),
+            accepted_sent=Sum('count', filter=sent & Q(status="accepted")),
+            pending_received=Sum('count', filter=received & Q(status="pending")),
+            accepted_received=Sum('count', filter=received & Q(status="accepted")),
+            new_this_month_sent=Sum('count', filter=sent & this_month),
+            new_this_month_received=Sum('count', filter=received & this_month),
+        )
+        data = {key: value or 0 for key, value in counts.items()}
 
-        return Response(data)
+        return data, 200
 
-    @action(detail=False, methods=['get'], url_path='patients-summary')
-    def patients_summary(self, request):
-        user = request.user
-        patients, _, _ = self._get_user_scope(user)
+    def _patients_summary_data(self, user, params):
+        scope = self._get_rollup_scope(user)
 
-        month_str = request.query_params.get('month')
+        month_str = params.get('month')
         if not month_str:
-            return Response({"error": "Month parameter is required"}, status=400)
+            return {"error": "Month parameter is required"}, 400
         try:
             year, month = map(int, month_str.split('-'))
             current_month = datetime(year, month, 1)
         except ValueError:
-            return Response({"error": "Invalid month format. Use YYYY-MM"}, status=400)
-
-        total_patients = patients.count()
-        new_patients_this_month = patients.filter(
-            date_joined__year=year,
-            date_joined__month=month
-        ).count()
-
-        last_six_months_totals = []
-        for i in range(5, -1, -1):
-            dt = current_month - relativedelta(months=i)
-            count = patients.filter(
-                date_joined__year=dt.year,
-                date_joined__month=dt.month
-            ).count()
-            last_six_months_totals.append(count)
+            return {"error": "Invalid month format. Use YYYY-MM"}, 400
+
+        month_starts = [(current_month - relativedelta(months=i)).date() for i in range(5, -1, -1)]
+
+        counts = {}
+        if scope is not None:
+            monthly_counts = {
+                f"m{i}": Sum('count', filter=Q(month=month_start))
+                for i, month_start in enumerate(month_starts)
+            }
+            counts = PatientMonthlyStat.objects.filter(scope).aggregate(total=Sum('count'), **monthly_counts)
+
+        total_patients = counts.get('total') or 0
+        last_six_months_totals = [counts.get(f"m{i}") or 0 for i in range(6)]
+        new_patients_this_month = last_six_months_totals[-1]
 
         data = {
             "total_patients": total_patients,
@@ -228,92 +251,73 @@ class DashboardViewSet(viewsets.GenericViewSet):
             "last_six_months_totals": last_six_months_totals,
         }
 
-        return Response(data)
+        return data, 200
 
-    @action(detail=False, methods=['get'], url_path='patient-nationality-map')
-    def patient_nationality_map(self, request):
-        user = request.user
+    def _patient_nationality_map_data(self, user, params):
         patients, _, _ = self._get_user_scope(user)
 
+        rows = patients.values('country').annotate(count=Count('id')).order_by()
+
         nationality_map = {}
-        for patient in patients:
-            country = getattr(patient, "country", None) or "Unknown"
-            if hasattr(country, "code"):
-                country_code = country.code
-            else:
-                country_code = str(country)
+        for row in rows:
+            country_name = self._country_name(row['country'])
+            nationality_map[country_name] = nationality_map.get(country_name, 0) + row['count']
 
-            try:
-                country_obj = pycountry.countries.get(alpha_2=country_code.upper())
-                country_name = country_obj.name if country_obj else country_code
-            except Exception:
-                country_name = country_code
+        return nationality_map, 200
 
-            nationality_map[str(country_name)] = nationality_map.get(str(country_name), 0) + 1
+    def _country_name(self, country_code):
+        country_code = country_code or "Unknown"
+        return COUNTRY_NAMES.get(country_code.upper(), country_code)
 
-        return Response(nationality_map)
+    def _appointment_buckets(self, period, now):
+        """
+        Returns (bucket start dates, day -> bucket start, label builder, range end)
+        for a period, expressed as local dates.
+        """
+        today = dj_timezone.localtime(now).date()
 
-    @action(detail=False, methods=['get'], url_path='appointments-summary')
-    def appointments_summary(self, request):
+        if period == 'week':
+            starts = [today - timedelta(days=i) for i in range(6, -1, -1)]
+            return starts, lambda d: d, lambda d: d.strftime("%a"), starts[-1] + timedelta(days=1)
+        if period == 'year':
+            first = today.replace(day=1)
+            starts = [first - relativedelta(months=i) for i in range(11, -1, -1)]
+            return (starts, lambda d: d.replace(day=1), lambda d: d.strftime("%b"),
+                    starts[-1] + relativedelta(months=1))
+
+        monday = today - timedelta(days=today.weekday())
+        starts = [monday - timedelta(weeks=i) for i in range(3, -1, -1)]
+        return (starts, lambda d: d - timedelta(days=d.weekday()), lambda d: f"Week {d.strftime('%U')}",
+                starts[-1] + timedelta(weeks=1))
+
+    def _appointments_summary_data(self, user, params):
         """
-        Returns appointment summary including pending, accepted, and rejected counts,
-        grouped by period (week, month, year).
+        Reads the daily appointment rollups and folds them into period buckets.
         """
-        user = request.user
-        _, appointments, now = self._get_user_scope(user)
+        scope = self._get_rollup_scope(user)
+        now = dj_timezone.now()
 
-        period = request.query_params.get('period', 'month')  
-        data = []
+        period = params.get('period', 'month')
+        starts, bucket_of, label_for, end = self._appointment_buckets(period, now)
 
-        if period == 'week':
-            start_date = now - timedelta(days=6)
-            date_format = "%a"
-        elif period == 'year':
-            start_date = now - relativedelta(months=11)
-            date_format = "%b"
-        else:  
-            start_date = now - relativedelta(weeks=3)
-            date_format = "W%U"
+        counts = {start: {"total": 0, "pending": 0, "accepted": 0, "rejected": 0} for start in starts}
+        if scope is not None:
+            rows = (
+                AppointmentDailyStat.objects
+                .filter(scope, day__gte=starts[0], day__lt=end)
+                .values_list('day', 'status', 'count')
+            )
+            for day, appointment_status, count in rows:
+                bucket = counts[bucket_of(day)]
+                bucket["total"] += count
+                if appointment_status in bucket:
+                    bucket[appointment_status] += count
 
+        data = []
         previous_total = 0
-        cursor = start_date
-
-        while cursor <= now:
-            if period == 'year':
-                period_start = datetime(cursor.year, cursor.month, 1, tzinfo=dj_timezone.utc)
-                period_end = period_start + relativedelta(months=1)
-                label = cursor.strftime(date_format)
-                cursor += relativedelta(months=1)
-            elif period == 'month':
-                period_start = cursor
-                period_end = cursor + timedelta(weeks=1)
-                label = f"Week {cursor.strftime('%U')}"
-                cursor += timedelta(weeks=1)
-            else:  # week
-                period_start = cursor
-                period_end = cursor + timedelta(days=1)
-                label = cursor.strftime(date_format)
-                cursor += timedelta(days=1)
-
-            total = appointments.filter(
-                scheduled_date__gte=period_start,
-                scheduled_date__lt=period_end
-            ).count()
-            pending = appointments.filter(
-                scheduled_date__gte=period_start,
-                scheduled_date__lt=period_end,
-                status='pending'
-            ).count()
-            accepted = appointments.filter(
-                scheduled_date__gte=period_start,
-                scheduled_date__lt=period_end,
-                status='accepted'
-            ).count()
-            rejected = appointments.filter(
-                scheduled_date__gte=period_start,
-                scheduled_date__lt=period_end,
-                status='rejected'
-            ).count()
+        for bucket_start in starts:
+            bucket = counts[bucket_start]
+            total = bucket["total"]
 
             if previous_total == 0:
                 growth = 0
@@ -324,16 +328,118 @@ class DashboardViewSet(viewsets.GenericViewSet):
             previous_total = total
 
             data.append({
-                "date": label,
+                "date": label_for(bucket_start),
                 "total": total,
-                "pending": pending,
-                "accepted": accepted,
-                "rejected": rejected,
+                "pending": bucket["pending"],
+                "accepted": bucket["accepted"],
+                "rejected": bucket["rejected"],
                 "growth": growth,
                 "deltaUp": delta_up,
             })
 
-        return Response(data)
+        return data, 200
+
+    def _overview_data(self, user, params):
+        """
+        All dashboard summaries plus DashboardSummarySerializer fields, sharing one user scope.
+        """
+        patients, appointments, now = self._get_user_scope(user)
+        scope = self._get_rollup_scope(user)
+
+        params = params.dict() if hasattr(params, 'dict') else dict(params)
+        params.setdefault('month', dj_timezone.localdate().strftime('%Y-%m'))
+
+        patients_summary, status_code = self._patients_summary_data(user, params)
+        if status_code != 200:
+            return patients_summary, status_code
+        links_summary, _ = self._links_summary_data(user, params)
+        appointments_summary, _ = self._appointments_summary_data(user, params)
+
+        patients_by_country = {}
+        patients_by_city = {}
+        for row in patients.values('country', 'city').annotate(count=Count('id')).order_by():
+            country_name = self._country_name(row['country'])
+            city = row['city'] or "Unknown"
+            patients_by_country[country_name] = patients_by_country.get(country_name, 0) + row['count']
+            patients_by_city[city] = patients_by_city.get(city, 0) + row['count']
+
+        appointments_by_status = {}
+        if scope is not None:
+            rows = AppointmentDailyStat.objects.filter(scope).values('status').annotate(total=Sum('count')).order_by()
+            appointments_by_status = {row['status']: row['total'] for row in rows if row['total']}
+
+        upcoming = appointments.filter(scheduled_date__gte=now).aggregate(
+            count=Count('id'),
+            next_date=Min('scheduled_date'),
+        )
+
+        summary = DashboardSummarySerializer({
+            "total_patients": patients_summary["total_patients"],
+            "new_patients_this_month": patients_summary["new_patients_this_month"],
+            "total_appointments": sum(appointments_by_status.values()),
+            "upcoming_appointments": upcoming['count'],
+            "appointments_by_status": appointments_by_status,
+            "patients_by_country": patients_by_country,
+            "patients_by_city": patients_by_city,
+            "next_appointment": upcoming['next_date'],
+        }).data
+
+        data = {
+            "summary": summary,
+            "links": links_summary,
+            "patients": patients_summary,
+            "nationality_map": patients_by_country,
+            "appointments": appointments_summary,
+        }
+        return data, 200
+
+    def _cached_response(self, request, action_name, compute):
+        data, status_code = dashboard_cache.get_or_compute(
+            request.user,
+            action_name,
+            request.query_params.dict(),
+            lambda: compute(request.user, request.query_params),
+        )
+        return Response(data, status=status_code)
+
+    @action(detail=False, methods=['get'], url_path='links-summary')
+    def links_summary(self, request):
+        return self._cached_response(request, 'links-summary', self._links_summary_data)
+
+    @action(detail=False, methods=['get'], url_path='patients-summary')
+    def patients_summary(self, request):
+        return self._cached_response(request, 'patients-summary', self._patients_summary_data)
+
+    @action(detail=False, methods=['get'], url_path='patient-nationality-map')
+    def patient_nationality_map(self, request):
+        return self._cached_response(request, 'patient-nationality-map', self._patient_nationality_map_data)
+
+    @action(detail=False, methods=['get'], url_path='appointments-summary')
+    def appointments_summary(self, request):
+        """
+        Returns appointment summary including pending, accepted, and rejected counts,
+        grouped by period (week, month, year).
+        """
+        return self._cached_response(request, 'appointments-summary', self._appointments_summary_data)
+
+    @action(detail=False, methods=['get'], url_path='overview')
+    def overview(self, request):
+        """
+        Returns every dashboard summary in one response.
+        Accepts the same `month` (defaults to the current month) and `period` params.
+        """
+        return self._cached_response(request, 'overview', self._overview_data)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAuthenticated, IsAdminRole])
+    def cache_stats(self, request):
+        return Response(dashboard_cache.stats())
+
+    @action(detail=False, methods=['get'], url_path='chat-queue-stats', permission_classes=[IsAuthenticated, IsAdminRole])
+    def chat_queue_stats(self, request):
+        """
+        Depth and flush latency of this process's chat write-behind queue.
+        """
+        return Response(message_queue.stats())
     
 
 # =========================
@@ -686,6 +792,20 @@ def update_appointment_status(request, pk):
 # =========================
 # UserLink / Community
 # =========================
+class CommunityCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'id'
+
+
+class NotificationCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-event_at'
+
+
 class UserLinkViewSet(viewsets.ModelViewSet):
     """
     Handles connection requests between users.
@@ -717,7 +837,7 @@ class UserLinkViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        return UserLink.objects.filter(Q(from_user=user) | Q(to_user=user))
+        return UserLink.objects.filter(Q(from_user=user) | Q(to_user=user)).select_related('from_user', 'to_user')
 
     def perform_create(self, serializer):
         serializer.save(from_user=self.request.user, status='pending')
@@ -732,7 +852,7 @@ class UserLinkViewSet(viewsets.ModelViewSet):
     def remove_link(self, request, pk=None):
         user = request.user
         try:
-            link = UserLink.objects.get(pk=pk)
+            link = UserLink.objects.select_related('from_user', 'to_user').get(pk=pk)
             if link.from_user != user and link.to_user != user:
                 return Response({"detail": "Not allowed"}, status=status.HTTP_403_FORBIDDEN)
             link.delete()
@@ -744,7 +864,7 @@ class UserLinkViewSet(viewsets.ModelViewSet):
     def accept(self, request, pk=None):
         user = request.user
         try:
-            link = UserLink.objects.get(pk=pk)
+            link = UserLink.objects.select_related('from_user', 'to_user').get(pk=pk)
             if link.to_user != user:
                 return Response({"detail": "Not allowed"}, status=status.HTTP_403_FORBIDDEN)
             link.status = 'accepted'
@@ -760,7 +880,7 @@ class UserLinkViewSet(viewsets.ModelViewSet):
     def reject(self, request, pk=None):
         user = request.user
         try:
-            link = UserLink.objects.get(pk=pk)
+            link = UserLink.objects.select_related('from_user', 'to_user').get(pk=pk)
             if link.to_user != user:
                 return Response({"detail": "Not allowed"}, status=status.HTTP_403_FORBIDDEN)
             self._send_notification(link.from_user.id, "request_rejected", link)
@@ -774,7 +894,7 @@ class UserLinkViewSet(viewsets.ModelViewSet):
     def cancel(self, request, pk=None):
         user = request.user
         try:
-            link = UserLink.objects.get(pk=pk)
+            link = UserLink.objects.select_related('from_user', 'to_user').get(pk=pk)
             if link.from_user != user:
                 return Response({"detail": "Not allowed"}, status=status.HTTP_403_FORBIDDEN)
             if link.status != 'pending':
@@ -786,63 +906,172 @@ class UserLinkViewSet(viewsets.ModelViewSet):
         except UserLink.DoesNotExist:
             return Response({"detail": "Link not found"}, status=status.HTTP_404_NOT_FOUND)
 
+    def _connection_statuses(self, user):
+        """
+        Returns {other user id: link status} for every link the user is part of, in one query.
+        """
+        statuses = {}
+        links = UserLink.objects.filter(Q(from_user=user) | Q(to_user=user)).values_list(
+            'from_user_id', 'to_user_id', 'status'
+        )
+        for from_user_id, to_user_id, link_status in links:
+            other_id = to_user_id if from_user_id == user.id else from_user_id
+            if other_id is not None:
+                statuses.setdefault(other_id, link_status)
+        return statuses
+
     @action(detail=False, methods=['GET'])
     def community(self, request):
+        """
+        Cursor-paginated people finder.
+        Supports ?role=, ?country=, ?connection_status=(none|pending|accepted)
+        and ?search= (prefix match on username, first and last name).
+        """
         current_user = request.user
-        all_users = User.objects.exclude(id=current_user.id)
+        statuses = self._connection_statuses(current_user)
+        users = User.objects.exclude(id=current_user.id)
+
+        role = request.query_params.get('role')
+        if role:
+            users = users.filter(role=role)
+
+        country = request.query_params.get('country')
+        if country:
+            users = users.filter(country=country.upper())
+
+        connection_status = request.query_params.get('connection_status')
+        if connection_status == 'none':
+            users = users.exclude(id__in=list(statuses))
+        elif connection_status:
+            users = users.filter(
+                id__in=[user_id for user_id, link_status in statuses.items() if link_status == connection_status]
+            )
+
+        search = request.query_params.get('search', '').strip()
+        if search:
+            users = users.filter(
+                Q(username__istartswith=search) |
+                Q(first_name__istartswith=search) |
+                Q(last_name__istartswith=search)
+            )
+
+        paginator = CommunityCursorPagination()
+        page = paginator.paginate_queryset(users, request, view=self)
         serializer = CommunityUserSerializer(
-            all_users,
+            page,
             many=True,
-            context={'request': request, 'current_user': current_user}
+            context={
+                'request': request,
+                'current_user': current_user,
+                'connection_statuses': statuses,
+            }
         )
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['GET'])
     def notifications(self, request):
-        """Return pending requests and accepted requests for the current user"""
+        """
+        Return pending requests and accepted requests for the current user,
+        newest event first, cursor-paginated on the event timestamp.
+        """
         user = request.user
 
-        
-        pending_requests = UserLink.objects.filter(to_user=user, status='pending')
+        links = (
+            UserLink.objects
+            .filter(Q(to_user=user, status='pending') | Q(from_user=user, status='accepted'))
+            .select_related('from_user', 'to_user')
+            .annotate(event_at=Case(
+                When(status='pending', then=F('created_at')),
+                default=F('updated_at'),
+            ))
+        )
 
-        
-        accepted_requests = UserLink.objects.filter(from_user=user, status='accepted')
+        paginator = NotificationCursorPagination()
+        page = paginator.paginate_queryset(links, request, view=self)
+        serialized = UserLinkSerializer(page, many=True, context={'request': request}).data
 
         notifications = []
-
-       
-        for link in pending_requests:
-            serializer = UserLinkSerializer(link, context={'request': request})
-            data = serializer.data
-            data['type'] = 'request'
-            data['from_user'] = {
-                'id': link.from_user.id,
-                'username': link.from_user.username,
-                'profile_picture': serializer.data['from_user_profile_picture'],
-            }
-            data['created_at'] = link.created_at
-            notifications.append(data)
-
-        
-        for link in accepted_requests:
-            serializer = UserLinkSerializer(link, context={'request': request})
-            data = serializer.data
-            data['type'] = 'accepted'
+        for link, data in zip(page, serialized):
+            if link.status == 'pending':
+                data['type'] = 'request'
+                other, picture = link.from_user, data['from_user_profile_picture']
+            else:
+                data['type'] = 'accepted'
+                other, picture = link.to_user, data['to_user_profile_picture']
             data['from_user'] = {
-                'id': link.to_user.id,
-                'username': link.to_user.username,
-                'profile_picture': serializer.data['to_user_profile_picture'],
+                'id': other.id,
+                'username': other.username,
+                'profile_picture': picture,
             }
-            data['created_at'] = link.updated_at
+            data['created_at'] = link.event_at
             notifications.append(data)
 
-        notifications.sort(key=lambda n: n['created_at'], reverse=True)
-        return Response(notifications)
+        return paginator.get_paginated_response(notifications)
 
 
 # =========================
 # Threads & Messages
 # =========================
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id). `before` / `after` take a message id and
+    return the page right before / after it; without either the newest page is returned.
+    Results are always in chronological order.
+    """
+    page_size = MESSAGE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def _cursor(self, request, name):
+        value = request.query_params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        `queryset` is a list of message querysets, oldest first, as from archive.message_sources().
+        """
+        self.request = request
+        size = self.get_page_size(request)
+        before = self._cursor(request, 'before')
+        after = self._cursor(request, 'after')
+
+        rows = archive.history_page(queryset, size + 1, before=before, after=after)
+        if after is not None:
+            self.has_next, self.has_previous = len(rows) > size, True
+            rows = rows[:size]
+        else:
+            self.has_previous, self.has_next = len(rows) > size, before is not None
+            rows = rows[-size:]
+
+        self.first_id = rows[0].id if rows else (after or before)
+        self.last_id = rows[-1].id if rows else (after or before)
+        return rows
+
+    def _link(self, name, value):
+        url = remove_query_param(self.request.build_absolute_uri(), 'before' if name == 'after' else 'after')
+        return replace_query_param(url, name, value)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link('after', self.last_id) if self.has_next and self.last_id else None,
+            'previous': self._link('before', self.first_id) if self.has_previous and self.first_id else None,
+            'results': data,
+        })
+
+
 class ThreadViewSet(viewsets.ModelViewSet):
     """
     Handles creating threads, listing threads, and marking messages as read.
@@ -851,16 +1080,92 @@ class ThreadViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        return Thread.objects.filter(participants=user).distinct()
+        thread_messages = Message.objects.filter(thread=OuterRef('pk')).order_by('-created_at', '-id')
+        read_cursor = ThreadReadState.objects.filter(thread=OuterRef('pk'), user=user).values('last_read_message_id')
+        unread = (
+            Message.objects.filter(thread=OuterRef('pk'), id__gt=OuterRef('read_cursor'))
+            .exclude(sender=user)
+            .order_by()
+            .values('thread')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return (
+            Thread.objects.filter(participants=user)
+            .annotate(read_cursor=Coalesce(Subquery(read_cursor[:1]), 0))
+            .annotate(
+                last_message_id=Subquery(thread_messages.values('id')[:1]),
+                last_activity=Coalesce(Subquery(thread_messages.values('created_at')[:1]), F('created_at')),
+                unread_count=Coalesce(Subquery(unread), 0),
+            )
+            .prefetch_related('participants')
+            .order_by('-last_activity', '-id')
+        )
 
     def get_serializer_class(self):
         if self.action in ['retrieve']:
             return ThreadDetailSerializer
         return ThreadSerializer
 
-    def perform_create(self, serializer):
-        thread = serializer.save()
-        thread.participants.add(self.request.user)
+    def list(self, request, *args, **kwargs):
+        """
+        Lists the user's threads by last activity. Last messages and read cursors are loaded in one batch each.
+        """
+        threads = list(self.filter_queryset(self.get_queryset()))
+        last_messages = (
+            Message.objects
+            .select_related('sender')
+            .in_bulk([thread.last_message_id for thread in threads if thread.last_message_id])
+        )
+        read_states = {thread.id: [] for thread in threads}
+        for state in (
+            ThreadReadState.objects.filter(thread__in=threads).select_related('user').order_by('user_id')
+        ):
+            read_states[state.thread_id].append(state)
+        context = self.get_serializer_context()
+        context['last_messages'] = last_messages
+        context['read_states'] = read_states
+        serializer = ThreadSerializer(threads, many=True, context=context)
+        return Response(serializer.data)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Creates a thread with the current user and the users in `participants` (or `user_id`).
+        A thread with exactly one other user is the canonical 1:1 thread, returned if it exists.
+        """
+        raw_ids = request.data.get('participants') or []
+        if not isinstance(raw_ids, (list, tuple)):
+            raw_ids = [raw_ids]
+        if request.data.get('user_id') not in (None, ''):
+            raw_ids = [*raw_ids, request.data['user_id']]
+        try:
+            other_ids = {int(user_id) for user_id in raw_ids} - {request.user.id}
+        except (TypeError, ValueError):
+            return Response({'detail': 'participants must be user ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        others = list(User.objects.filter(id__in=other_ids))
+        if len(others) != len(other_ids):
+            return Response({'detail': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        if len(others) == 1:
+            thread, created = Thread.get_or_create_direct(request.user, others[0])
+        else:
+            with transaction.atomic():
+                thread = Thread.objects.create()
+                thread.participants.add(request.user, *others)
+            created = True
+        serializer = ThreadSerializer(thread, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    @action(detail=True, methods=['GET'])
+    def messages(self, request, pk=None):
+        """
+        Message history of the thread, keyset-paginated with ?before=<id> / ?after=<id>.
+        """
+        thread = generics.get_object_or_404(Thread.objects.filter(participants=request.user), pk=pk)
+        paginator = MessageKeysetPagination()
+        page = paginator.paginate_queryset(archive.message_sources(thread.id), request, view=self)
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['POST'])
     def mark_read(self, request, pk=None):
@@ -869,13 +1174,60 @@ class ThreadViewSet(viewsets.ModelViewSet):
         """
         user = request.user
         thread = self.get_object()
-        unread_messages = thread.messages.exclude(read_by=user)
-        for msg in unread_messages:
-            msg.read_by.add(user)  # use add() for ManyToManyField
+        last_message_id = thread.messages.aggregate(last=Max('id'))['last']
+        if last_message_id and ThreadReadState.advance(thread.id, user.id, last_message_id):
+            notify_read_receipt(thread.id, user.id, last_message_id)
 
         return Response({'detail': 'Messages marked as read'}, status=status.HTTP_200_OK)
 
 
+class MessageSearchPagination(BasePagination):
+    """
+    Keyset pagination over (rank desc, id desc) for search results; only forward links.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def _decode_cursor(self, request):
+        encoded = request.query_params.get('cursor')
+        if not encoded:
+            return None
+        try:
+            rank, message_id = b64decode(encoded.encode('ascii')).decode('ascii').split('_')
+            return float(rank), int(message_id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        cursor = self._decode_cursor(request)
+        if cursor is not None:
+            rank, message_id = cursor
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=message_id))
+        rows = list(queryset.order_by('-rank', '-id')[:size + 1])
+        self.next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            self.next_cursor = b64encode(f'{rows[-1].rank!r}_{rows[-1].id}'.encode('ascii')).decode('ascii')
+        return rows
+
+    def get_paginated_response(self, data):
+        next_url = None
+        if self.next_cursor:
+            next_url = replace_query_param(self.request.build_absolute_uri(), 'cursor', self.next_cursor)
+        return Response({'next': next_url, 'results': data})
+
+
 class MessageViewSet(viewsets.ModelViewSet):
     """
     Handles creating and listing messages within threads.
@@ -890,19 +1242,43 @@ class MessageViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         message = serializer.save(sender=self.request.user)
         
-        message.read_by.add(self.request.user)
+        message.advance_sender_cursor()
+
+    @action(detail=False, methods=['GET'])
+    def search(self, request):
+        """
+        Full-text search over the user's threads: ?q=<words>[&thread=<id>], best matches first.
+        """
+        words = message_search.terms(request.query_params.get('q', ''))
+        if not words:
+            return Response({'detail': 'q is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        messages = Message.objects.filter(thread__participants=request.user).select_related('sender')
+        thread_id = request.query_params.get('thread')
+        if thread_id:
+            if not thread_id.isdigit():
+                return Response({'detail': 'thread must be an id.'}, status=status.HTTP_400_BAD_REQUEST)
+            messages = messages.filter(thread_id=thread_id)
+
+        paginator = MessageSearchPagination()
+        page = paginator.paginate_queryset(message_search.search(messages, words), request, view=self)
+        context = self.get_serializer_context()
+        context['search_terms'] = words
+        serializer = MessageSearchResultSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class ThreadWithMessagesViewSet(viewsets.ReadOnlyModelViewSet):
     """
-    Provides a read-only view of threads with all messages included.
+    Provides a read-only view of threads with their newest page of messages.
+    Older messages are served by ThreadViewSet.messages.
     """
     serializer_class = ThreadDetailSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
-        return Thread.objects.filter(participants=user).prefetch_related('messages').distinct()
+        return Thread.objects.filter(participants=user).prefetch_related('participants').distinct()
 
     @action(detail=False, methods=['get', 'post'], url_path='get_or_create_with_user')
     def get_or_create_with_user(self, request):
@@ -925,20 +1301,71 @@ class ThreadWithMessagesViewSet(viewsets.ReadOnlyModelViewSet):
         except User.DoesNotExist:
             return Response({'detail': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        
-        thread = Thread.objects.filter(participants=current_user)\
-                               .filter(participants=other_user)\
-                               .distinct()\
-                               .first()
-
-        if not thread:
-           
-            thread = Thread.objects.create()
-            thread.participants.add(current_user, other_user)
+        thread, _ = Thread.get_or_create_direct(current_user, other_user)
 
         serializer = ThreadSerializer(thread, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK) 
     
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    """
+    Delta sync for reconnecting chat clients: what changed after ?since=<cursor>.
+    Without `since` only the current cursor is returned, to start syncing from after a full load.
+    """
+    user = request.user
+    since = request.query_params.get('since')
+    if since in (None, ''):
+        return Response({'cursor': changes.latest_cursor(user), 'has_more': False})
+    if not since.isdigit():
+        return Response({'detail': 'since must be a cursor returned by this endpoint.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if changes.expired(int(since)):
+        return Response({'detail': 'since predates the kept change history; reload and sync from a new cursor.'},
+                        status=status.HTTP_410_GONE)
+
+    events, cursor, has_more = changes.changes_since(user, int(since), getattr(settings, 'SYNC_PAGE_SIZE', 500))
+
+    ids = {kind: set() for kind, _ in ChangeEvent.KIND_CHOICES}
+    read_states = {}
+    for event in events:
+        ids[event.kind].add(event.object_id)
+        if event.kind == 'read_state':
+            # Read events carry the cursor itself; the last one per user and thread wins.
+            read_states[(event.thread_id, event.user_id)] = event
+
+    messages = Message.objects.select_related('sender').in_bulk(ids['message'])
+    if ids['message'] - set(messages):
+        # Not deleted if it was only moved to the archive.
+        messages.update(ArchivedMessage.objects.select_related('sender').in_bulk(ids['message'] - set(messages)))
+    links = UserLink.objects.select_related('from_user', 'to_user').in_bulk(ids['link'])
+    threads = Thread.objects.filter(pk__in=ids['thread'], participants=user).prefetch_related('participants')
+    context = {'request': request}
+
+    return Response({
+        'cursor': cursor,
+        'has_more': has_more,
+        'messages': MessageSerializer(
+            [messages[pk] for pk in sorted(messages)], many=True, context=context
+        ).data,
+        'deleted_messages': sorted(ids['message_deleted'] | (ids['message'] - set(messages))),
+        'read_states': [
+            {
+                'thread': event.thread_id,
+                'user_id': event.user_id,
+                'last_read_message_id': event.object_id,
+                'last_read_at': event.created_at,
+            }
+            for event in read_states.values()
+        ],
+        'threads': GetOrCreateThreadSerializer(threads, many=True, context=context).data,
+        'links': UserLinkSerializer(
+            [links[pk] for pk in sorted(links)], many=True, context=context
+        ).data,
+        'deleted_links': sorted(ids['link_deleted'] | (ids['link'] - set(links))),
+    })
+
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -87,6 +88,62 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Unread messages replayed when a chat socket connects (newest first wins), and messages per "history" frame.
+CHAT_REPLAY_LIMIT = 200
+CHAT_REPLAY_CHUNK_SIZE = 100
+
+# Inbound {"type": "read"} frames on a chat socket are coalesced over this window.
+CHAT_READ_COALESCE_MS = 500
+
+# Presence lives in the cache: sockets not heard from (connect or heartbeat) within the TTL count as gone.
+CHAT_PRESENCE_TTL = 60
+CHAT_TYPING_THROTTLE_SECONDS = 2
+
+# Sockets opened with ?encoding=msgpack&compress=deflate get batched frames above this size deflated.
+WS_DEFLATE_MIN_BYTES = 1024
+# Inbound socket frames larger than this (after inflating) close the connection.
+WS_MAX_INBOUND_FRAME_BYTES = 64 * 1024
+
+# Delta sync: events per response, and how old an event must be before the cursor moves past it.
+SYNC_PAGE_SIZE = 500
+SYNC_SETTLE_SECONDS = 2
+# Change events older than this are pruned by `archive_messages`; older cursors get 410 Gone.
+SYNC_RETENTION_DAYS = 30
+
+# Write-behind chat persistence (PostgreSQL only): broadcast at once, store in batches of N
+# messages or every M ms. A message that fails MAX_ATTEMPTS writes goes to the dead-letter log.
+CHAT_WRITE_BEHIND = False
+CHAT_WRITE_BEHIND_BATCH_SIZE = 50
+CHAT_WRITE_BEHIND_INTERVAL_MS = 200
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = 3
+
+# Messages older than this many days move to the compressed archive table (`archive_messages` command).
+MESSAGE_RETENTION_DAYS = 365
+MESSAGE_ARCHIVE_BATCH_SIZE = 1000
+
+
+# Cache. Chat presence, typing throttles and dashboard invalidation only reach other workers
+# through a shared cache, so deployments set REDIS_CACHE_URL (e.g. redis://127.0.0.1:6379/1, the
+# channel layer's Redis server). Without it, and always under `manage.py test` (whose setUp
+# calls cache.clear()), each process gets its own local-memory cache.
+REDIS_CACHE_URL = os.environ.get("REDIS_CACHE_URL")
+if REDIS_CACHE_URL and sys.argv[1:2] != ["test"]:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# Dashboard responses are invalidated by model signals; the timeout is only a safety net.
+DASHBOARD_CACHE_TIMEOUT = 60
+
 
 # Database
 DATABASES = {